@@ -1,6 +1,6 @@
 
 
-from typing import List
+from typing import List, Optional
 from pydantic_settings import BaseSettings
 import os
 import json
@@ -12,6 +12,7 @@ class Settings(BaseSettings):
     azure_openai_api_version: str = "2024-02-15-preview"
     azure_openai_deployment_name: str = "gpt-4o"
     azure_openai_embedding_deployment_name: str = "text-embedding-3-small"
+    azure_openai_title_deployment_name: Optional[str] = None  # e.g. a gpt-4o-mini deployment for chat titles
     
     bing_api_key: str
     google_api_key: str
@@ -24,11 +25,93 @@ class Settings(BaseSettings):
     # MongoDB
     mongodb_url: str = "mongodb://localhost:27017"
     mongodb_database: str = "chatgpt_clone"
+    mongodb_use_transactions: bool = False  # requires a replica set
+
+    # Conversation context
+    context_max_tokens: int = 12000  # prompt budget for system prompt + history
+    summary_trigger_messages: int = 20  # un-summarized messages before the summary is updated
+    summary_keep_recent_messages: int = 10  # newest messages always sent verbatim
+
+    # Semantic response cache (opt-in)
+    semantic_cache_enabled: bool = False
+    semantic_cache_threshold: float = 0.95  # cosine similarity needed for a hit
+    semantic_cache_ttl_seconds: int = 86400
+    semantic_cache_max_entries: int = 5000
+    semantic_cache_max_history: int = 0  # earlier messages allowed in a cacheable prompt
+
+    # In-process chat history cache (entries are checked against the chat's stored
+    # message_count/updated_at/summarized_until on each use, so it is safe with several workers)
+    history_cache_max_chats: int = 1000
+    history_cache_ttl_seconds: int = 300
+    history_cache_max_messages: int = 200  # per chat, newest kept
+
+    # Outbound HTTP (shared, pooled clients)
+    http2_enabled: bool = True  # used when the h2 package is installed
+    http_max_connections: int = 20  # per upstream
+    http_max_keepalive_connections: int = 10
+    http_keepalive_expiry_seconds: float = 30.0
+    google_timeout_seconds: float = 10.0
+    tts_timeout_seconds: float = 60.0
+
+    # Web search result cache
+    search_cache_max_entries: int = 1000
+    search_cache_ttl_seconds: int = 300
+    search_cache_stale_seconds: int = 900  # past the TTL, served while a refresh runs
+
+    # Server-side web grounding (MessageCreate.web_grounding)
+    web_grounding_enabled: bool = True
+    web_grounding_results: int = 5  # search results whose pages are read
+    web_fetch_timeout_seconds: float = 4.0  # per page, from connect to the last byte
+    web_fetch_max_bytes: int = 1048576  # 1MB read per page before parsing
+    web_parse_timeout_seconds: float = 3.0  # per page; parsed in a thread, not the upload pool
+    web_context_max_tokens: int = 1500  # prompt budget for web passages
+    web_passages_per_page: int = 3
+    web_passage_chars: int = 700
+
+    # Text-to-speech
+    tts_long_text_chars: int = 600  # longer texts are synthesized as sentence segments
+    tts_first_segment_chars: int = 200  # kept short so audio starts quickly
+    tts_segment_max_chars: int = 1000  # Azure accepts at most 4096 per request
+    tts_segment_concurrency: int = 4  # segments synthesized at once per request
+    tts_cache_dir: str = "tts_cache"
+    tts_cache_max_bytes: int = 524288000  # 500MB across all cached audio, least recently played removed first
+    tts_cache_part_grace_seconds: int = 3600  # older partial files are treated as abandoned by a dead worker
 
     # FastAPI
     cors_origins: List[str] = ["http://localhost:5173", "http://localhost:3000"]
     upload_dir: str = "uploads"
     max_file_size: int = 10485760  # 10MB
+    upload_chunk_size: int = 1048576  # bytes read per step when streaming uploads to disk
+
+    # File extraction process pool
+    extraction_workers: int = 2
+    extraction_timeout_seconds: int = 120
+    extraction_memory_limit_mb: int = 2048  # per worker address-space cap, 0 disables
+    tabular_chunk_rows: int = 5000  # rows per chunk when profiling spreadsheets
+    csv_chunk_rows: int = 50000  # rows per pd.read_csv chunk; CSV parsing is cheap, so larger chunks
+    spreadsheet_profile_max_rows: int = 50000  # per sheet; totals still come from the sheet dimensions
+
+    # Background upload ingestion
+    ingestion_workers: int = 2  # uploads processed at once per app process
+    ingestion_job_lease_seconds: int = 900  # a job held longer than this by a dead worker is retried
+    ingestion_job_max_attempts: int = 3
+    ingestion_job_recover_seconds: int = 60  # how often expired leases are looked for
+    batch_upload_max_files: int = 10
+    batch_upload_concurrency: int = 4  # files extracted at once per batch
+    batch_upload_max_tokens: int = 6000  # extracted content of all files in a batch turn
+
+    # Images sent to the vision model
+    vision_cache_dir: str = "vision_cache"
+    vision_max_long_side: int = 2048  # the model's effective high-detail resolution
+    vision_max_short_side: int = 768
+    vision_jpeg_quality: int = 85
+
+    # Retrieval over uploaded documents
+    document_index_enabled: bool = True
+    vector_store_dir: str = "vector_store"
+    document_retrieval_top_k: int = 6
+    document_context_max_tokens: int = 2000  # prompt budget for retrieved passages
+    embedding_batch_size: int = 64
 
     class Config:
         env_file = ".env"
@@ -44,3 +127,5 @@ class Settings(BaseSettings):
 
 settings = Settings()
 os.makedirs(settings.upload_dir, exist_ok=True)
+os.makedirs(settings.vision_cache_dir, exist_ok=True)
+os.makedirs(settings.tts_cache_dir, exist_ok=True)
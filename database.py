@@ -1,7 +1,7 @@
 
 
 from motor.motor_asyncio import AsyncIOMotorClient
-from pymongo import ASCENDING
+from pymongo import ASCENDING, DESCENDING
 from config import settings
 import logging
 
@@ -20,8 +20,16 @@ async def connect_to_mongo():
         mongodb.database = mongodb.client[settings.mongodb_database]
         
         # Create indexes
-        await mongodb.database.messages.create_index([("chat_id", ASCENDING), ("timestamp", ASCENDING)])
+        # Serves history reads by (chat_id, timestamp) too; keyset pagination walks it in reverse
+        await mongodb.database.messages.create_index([("chat_id", ASCENDING), ("timestamp", ASCENDING), ("_id", ASCENDING)])
+        # Superseded by the index above, which has it as a prefix
+        if "chat_id_1_timestamp_1" in await mongodb.database.messages.index_information():
+            await mongodb.database.messages.drop_index("chat_id_1_timestamp_1")
         await mongodb.database.chats.create_index([("created_at", ASCENDING)])
+        # Backs the keyset-paginated chat list (newest activity first)
+        await mongodb.database.chats.create_index([("updated_at", DESCENDING), ("_id", DESCENDING)])
+        # Startup and periodic recovery look for unfinished upload jobs
+        await mongodb.database.ingestion_jobs.create_index([("status", ASCENDING), ("lease_until", ASCENDING)])
         
         logger.info("Connected to MongoDB")
     except Exception as e:
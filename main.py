@@ -1,10 +1,9 @@
 
 
 import os
-import uuid
-import shutil
+import json
 from typing import List, Optional
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Depends,Request
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Depends,Request, Query
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from langchain_core.documents import Document
@@ -12,19 +11,33 @@ from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from datetime import datetime
 
-from io import BytesIO
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, JSONResponse, FileResponse, Response
 
 from config import settings
 from database import connect_to_mongo, close_mongo_connection
 from models import (
     Chat, ChatCreate, ChatRename, MessageCreate,ChatResponse, 
-    ChatListResponse, ChatHistoryResponse, FileInfo,
-    MessageRequest, SearchQuery, TTSRequest
+    ChatListResponse, ChatHistoryResponse, MessagePageResponse,
+    MessageRequest, SearchQuery, TTSRequest, IngestionJob, JobStatus
 )
 
 from services.chat_service import chat_service
-from services.file_processor import file_processor
+from services.extraction_pool import extraction_pool
+from services.upload_storage import upload_storage, UploadTooLarge
+from services.extraction_cache import extraction_cache
+from services.task_runner import task_runner
+from services.history_cache import history_cache
+from services.semantic_cache import semantic_cache
+from services.document_index import document_index
+from services.ingestion_jobs import ingestion_jobs
+from services.upload_turns import process_upload_turn, process_batch_upload_turn
+from services.vision_cache import vision_cache
+from services.http_clients import http_clients
+from services.search_service import search_service
+from services.web_grounding import web_grounding
+from services.tts_service import tts_service
+from services.tts_cache import tts_cache
+from services.context_builder import context_builder
 import logging
 from datetime import datetime
 from database import get_database
@@ -45,8 +58,16 @@ logger = logging.getLogger(__name__)
 async def lifespan(app: FastAPI):
     # Startup
     await connect_to_mongo()
+    await context_builder.start()
+    http_clients.start()
+    extraction_pool.start()
+    await ingestion_jobs.start()
     yield
     # Shutdown
+    await ingestion_jobs.shutdown()
+    await task_runner.shutdown()
+    extraction_pool.shutdown()
+    await http_clients.shutdown()
     await close_mongo_connection()
 
 app = FastAPI(
@@ -68,6 +89,21 @@ app.add_middleware(
 UPLOAD_DIR = "uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+# Room for multipart boundaries and form fields on top of the file itself
+UPLOAD_FORM_OVERHEAD = 64 * 1024
+
+
+@app.middleware("http")
+async def reject_oversized_uploads(request: Request, call_next):
+    """Refuse uploads whose declared size is already over the limit, before the body is read"""
+    if request.method == "POST" and "/upload" in request.url.path:
+        content_length = request.headers.get("content-length")
+        max_files = settings.batch_upload_max_files if request.url.path.endswith("/upload/batch") else 1
+        if content_length and content_length.isdigit() and \
+                int(content_length) > max_files * settings.max_file_size + UPLOAD_FORM_OVERHEAD:
+            return JSONResponse(status_code=413, content={"detail": "File too large"})
+    return await call_next(request)
+
 
 
 # Serve uploaded files
@@ -88,11 +124,16 @@ async def create_new_chat(chat_data: ChatCreate):
         raise HTTPException(status_code=500, detail="Failed to create chat")
 
 @app.get("/api/chat", response_model=ChatListResponse)
-async def get_all_chats():
-    """Get all chat sessions"""
+async def get_all_chats(
+    limit: int = Query(50, ge=1, le=200),
+    before: Optional[str] = None,
+):
+    """Get chat sessions, newest activity first, one page at a time"""
     try:
-        chats = await chat_service.get_all_chats()
-        return ChatListResponse(chats=chats)
+        chats, next_cursor = await chat_service.get_all_chats(limit=limit, before=before)
+        return ChatListResponse(chats=chats, next_cursor=next_cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error fetching chats: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch chats")
@@ -113,6 +154,45 @@ async def get_chat_history(chat_id: str):
         logger.error(f"Error fetching chat history: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch chat history")
 
+@app.get("/api/chat/{chat_id}/messages", response_model=MessagePageResponse)
+async def get_chat_message_page(
+    chat_id: str,
+    limit: int = Query(50, ge=1, le=200),
+    before: Optional[str] = None,
+):
+    """Get a page of chat messages, newest first"""
+    try:
+        chat = await chat_service.get_chat(chat_id)
+        if not chat:
+            raise HTTPException(status_code=404, detail="Chat not found")
+
+        messages, next_cursor = await chat_service.get_message_page(chat_id, limit=limit, before=before)
+        return MessagePageResponse(messages=messages, next_cursor=next_cursor)
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error fetching chat messages: {e}")
+        raise HTTPException(status_code=500, detail="Failed to fetch chat messages")
+
+@app.get("/api/chat/{chat_id}/messages/stream")
+async def stream_chat_messages(chat_id: str):
+    """Stream the full chat history as NDJSON, one message per line, oldest first"""
+    chat = await chat_service.get_chat(chat_id)
+    if not chat:
+        raise HTTPException(status_code=404, detail="Chat not found")
+
+    async def message_stream():
+        try:
+            async for message in chat_service.iter_chat_messages(chat_id):
+                yield message.model_dump_json() + "\n"
+        except Exception as e:
+            logger.error(f"Error streaming chat messages: {e}")
+            yield json.dumps({"type": "error", "detail": "Failed to stream chat messages"}) + "\n"
+
+    return StreamingResponse(message_stream(), media_type="application/x-ndjson")
+
 @app.put("/api/chat/{chat_id}/rename")
 async def rename_chat(chat_id: str, rename_data: ChatRename):
     """Rename a chat"""
@@ -157,7 +237,8 @@ async def send_message(chat_id: str, message_data: MessageCreate):
         user_message, ai_message = await chat_service.process_message(
             chat_id, message_data.content,
             original_content=message_data.original_content,
-            web_search_results=web_search_results
+            web_search_results=web_search_results,
+            ground_on_web=message_data.web_grounding
         )
         
         return ChatResponse(
@@ -170,9 +251,57 @@ async def send_message(chat_id: str, message_data: MessageCreate):
     except Exception as e:
         logger.error(f"Error processing message: {e}")
         raise HTTPException(status_code=500, detail="Failed to process message")
+
+@app.post("/api/chat/{chat_id}/message/stream")
+async def send_message_stream(chat_id: str, message_data: MessageCreate):
+    """Send a message and stream the AI response as NDJSON events"""
+    chat = await chat_service.get_chat(chat_id)
+    if not chat:
+        raise HTTPException(status_code=404, detail="Chat not found")
+
+    async def event_stream():
+        try:
+            async for event in chat_service.stream_message(
+                chat_id, message_data.content,
+                original_content=message_data.original_content,
+                web_search_results=message_data.web_search_results,
+                ground_on_web=message_data.web_grounding
+            ):
+                if "message" in event:
+                    event = {**event, "message": event["message"].model_dump(mode="json")}
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+        except Exception as e:
+            logger.error(f"Error streaming message: {e}")
+            yield json.dumps({"type": "error", "detail": "Failed to process message"}) + "\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
     
 
 
+@app.get("/api/metrics")
+async def get_metrics():
+    """In-process cache and background work counters for this worker"""
+    return {
+        "history_cache": history_cache.stats(),
+        "semantic_cache": semantic_cache.stats(),
+        "extraction_pool": extraction_pool.stats(),
+        "extraction_cache": extraction_cache.stats(),
+        "document_index": document_index.stats(),
+        "vision_cache": vision_cache.stats(),
+        "ingestion_jobs": ingestion_jobs.stats(),
+        "http_clients": http_clients.stats(),
+        "web_search": search_service.stats(),
+        "web_grounding": web_grounding.stats(),
+        "tts": tts_service.stats(),
+        "tts_cache": tts_cache.stats(),
+        "background_tasks": task_runner.stats(),
+    }
+
+
 @app.post("/api/web-search")
 async def web_search(payload: SearchQuery):
     query = payload.query
@@ -180,33 +309,8 @@ async def web_search(payload: SearchQuery):
     if not query:
         return {"results": []}
 
-    api_key = settings.google_api_key
-    cx = settings.google_search_engine_id
-
-    url = "https://www.googleapis.com/customsearch/v1"
-    params = {
-        "key": api_key,
-        "cx": cx,
-        "q": query,
-        "num": 3
-    }
-
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, params=params)
-            response.raise_for_status()
-            result = response.json()
-
-        items = result.get("items", [])
-        web_results = [
-            {
-                "name": item.get("title"),
-                "url": item.get("link"),
-                "snippet": item.get("snippet")
-            }
-            for item in items
-        ]
-
+        web_results = await search_service.search(query, num=3)
         return {"results": web_results}
 
     except Exception as e:
@@ -228,76 +332,157 @@ async def upload_file(
         if not chat:
             raise HTTPException(status_code=404, detail="Chat not found")
 
-        if file.size > settings.max_file_size:
+        # Save file (streamed to disk, size enforced while reading)
+        try:
+            stored = await upload_storage.save(file)
+        except UploadTooLarge:
             raise HTTPException(status_code=413, detail="File too large")
 
-        # Save file
-        file_id = str(uuid.uuid4())
-        file_extension = os.path.splitext(file.filename)[1]
-        filename = f"{file_id}{file_extension}"
-        file_path = os.path.join(settings.upload_dir, filename)
+        # Analyze file, index it and answer
+        user_msg, ai_msg = await process_upload_turn(
+            chat_id, stored, message, original_content, web_search_results
+        )
+
+        return ChatResponse(chat_id=chat_id, message=user_msg, response=ai_msg)
 
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error processing file upload: {e}")
+        raise HTTPException(status_code=500, detail="Failed to process file upload")
 
-        # Analyze file
-        processed_content, file_type = await file_processor.process_file(file_path, file.filename)
 
-        # File info for DB
-        file_info = FileInfo(
-            filename=file.filename,
-            type=file.content_type,
-            url=f"/uploads/{filename}",
-            size=file.size,
-        )
+@app.post("/api/chat/{chat_id}/upload/batch", response_model=ChatResponse)
+async def upload_files(
+    chat_id: str,
+    files: List[UploadFile] = File(...),
+    message: Optional[str] = Form(None),
+    original_content: Optional[str] = Form(None),
+    web_search_results: Optional[str] = Form(None),
+):
+    """Upload several files and get one AI analysis of all of them"""
+    if len(files) > settings.batch_upload_max_files:
+        raise HTTPException(status_code=400, detail=f"At most {settings.batch_upload_max_files} files per upload")
 
-        combined_message = f"{message or ''}\n\n{processed_content}".strip()
+    try:
+        chat = await chat_service.get_chat(chat_id)
+        if not chat:
+            raise HTTPException(status_code=404, detail="Chat not found")
 
-        # Only send image path if vision is needed
-        image_path = file_path if file_type == "image" else None
+        try:
+            stored_files = [await upload_storage.save(file) for file in files]
+        except UploadTooLarge:
+            raise HTTPException(status_code=413, detail="File too large")
 
-        # ✅ Call with proper arguments
-        user_msg, ai_msg = await chat_service.process_message(
-            chat_id=chat_id,
-            content=combined_message,
-            original_content=original_content,
-            file_info=file_info,
-            web_search_results=web_search_results,
-            image_path=image_path
+        user_msg, ai_msg = await process_batch_upload_turn(
+            chat_id, stored_files, message, original_content, web_search_results
         )
-
         return ChatResponse(chat_id=chat_id, message=user_msg, response=ai_msg)
 
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error processing file upload: {e}")
+        logger.error(f"Error processing batch upload: {e}")
         raise HTTPException(status_code=500, detail="Failed to process file upload")
 
-@app.post("/api/tts")
-async def generate_speech(data: TTSRequest):
-    url = f"{settings.azure_tts_openai_api_endpoint}/openai/deployments/{settings.azure_tts_openai_api_deployment_name}/audio/speech?api-version={settings.azure_tts_openai_api_version}"
 
-    headers = {
-        "api-key":settings.azure_tts_openai_api_key,
-        "Content-Type": "application/json"
-    }
+@app.post("/api/chat/{chat_id}/upload/async", response_model=IngestionJob, status_code=202)
+async def upload_file_async(
+    chat_id: str,
+    file: UploadFile = File(...),
+    message: Optional[str] = Form(None),
+    original_content: Optional[str] = Form(None),
+    web_search_results: Optional[str] = Form(None),
+):
+    """Store an upload and process it in the background.
 
-    payload = {
-        "model": data.model,
-        "input": data.text,
-        "voice": data.voice
-    }
+    Returns 202 with an ingestion job; poll GET /api/jobs/{id} or follow
+    /api/jobs/{id}/events until it completes with the chat turn.
+    """
+    chat = await chat_service.get_chat(chat_id)
+    if not chat:
+        raise HTTPException(status_code=404, detail="Chat not found")
+
+    try:
+        stored = await upload_storage.save(file)
+    except UploadTooLarge:
+        raise HTTPException(status_code=413, detail="File too large")
+
+    return await ingestion_jobs.submit(chat_id, stored, message, original_content, web_search_results)
+
+
+@app.get("/api/jobs/{job_id}", response_model=IngestionJob)
+async def get_job(job_id: str):
+    """Status of an ingestion job"""
+    job = await ingestion_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get("/api/jobs/{job_id}/events")
+async def stream_job_events(job_id: str, request: Request):
+    """Server-sent events with the job's state each time it changes, until it finishes"""
+    job = await ingestion_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def event_stream():
+        current = job
+        last_sent = None
+        while True:
+            payload = current.model_dump_json(by_alias=True)
+            if payload != last_sent:
+                yield f"event: {current.status.value}\ndata: {payload}\n\n"
+                last_sent = payload
+            if current.status in (JobStatus.COMPLETED, JobStatus.FAILED):
+                return
+            if await request.is_disconnected():
+                return
+            await ingestion_jobs.wait_for_update(job_id, timeout=1.0)
+            current = await ingestion_jobs.get(job_id) or current
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def _tts_headers(key: str) -> dict:
+    # Content-Location points at the seekable GET copy once the audio is cached
+    return {"ETag": f'"{key}"', "Content-Location": f"/api/tts/{key}", "Cache-Control": "private, no-cache"}
 
-    async with httpx.AsyncClient(timeout=30) as client:
-        try:
-            response = await client.post(url, headers=headers, json=payload)
-            response.raise_for_status()
-        except httpx.HTTPError as e:
-            raise HTTPException(status_code=500, detail=f"TTS failed: {str(e)}")
 
-    audio_stream = BytesIO(response.content)
-    return StreamingResponse(audio_stream, media_type="audio/mpeg")
+@app.post("/api/tts")
+async def generate_speech(data: TTSRequest):
+    """Synthesized speech: served from the cache, or streamed as Azure produces it"""
+    key = tts_cache.key(data.text, data.voice, data.model)
+    cached_path = tts_cache.lookup(key)
+    if cached_path:
+        return FileResponse(cached_path, media_type="audio/mpeg", headers=_tts_headers(key))
+
+    try:
+        audio = await tts_service.open_audio(data.text, data.voice, data.model)
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=500, detail=f"TTS failed: {str(e)}")
+
+    return StreamingResponse(
+        tts_cache.tee(key, audio),
+        media_type="audio/mpeg",
+        headers={**_tts_headers(key), "X-Accel-Buffering": "no"},
+    )
+
+
+@app.api_route("/api/tts/{key}", methods=["GET", "HEAD"])
+async def get_cached_speech(key: str, request: Request):
+    """Previously synthesized speech, with Range for seeking and ETag revalidation"""
+    cached_path = tts_cache.lookup(key)
+    if not cached_path:
+        raise HTTPException(status_code=404, detail="Audio not found")
+    if_none_match = {tag.strip().removeprefix("W/") for tag in request.headers.get("if-none-match", "").split(",")}
+    if f'"{key}"' in if_none_match or "*" in if_none_match:
+        return Response(status_code=304, headers=_tts_headers(key))
+    return FileResponse(cached_path, media_type="audio/mpeg", headers=_tts_headers(key))
 
 if __name__ == "__main__":
     import uvicorn
@@ -27,6 +27,7 @@ class Message(BaseModel):
     content: str
     references: Optional[List[Reference]] = None  # ✅ Make optional
     file: Optional[FileInfo] = None
+    files: Optional[List[FileInfo]] = None  # attachments of a batch upload
     timestamp: datetime = Field(default_factory=datetime.utcnow)
 
 class Chat(BaseModel):
@@ -35,6 +36,9 @@ class Chat(BaseModel):
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
     message_count: int = 0
+    summary: Optional[str] = None  # rolling summary of turns older than summarized_until
+    summarized_until: Optional[datetime] = None
+    document_hashes: List[str] = Field(default_factory=list)  # indexed uploads this chat retrieves from
     
     class Config:
         populate_by_name = True
@@ -49,19 +53,46 @@ class MessageCreate(BaseModel):
     content: str
     original_content: Optional[str] = None
     web_search_results: Optional[str] = None  # ✅ NEW
+    web_grounding: bool = False  # search and read web pages server-side for this turn
 
 class ChatResponse(BaseModel):
     chat_id: str
     message: Message
     response: Message
 
+class JobStatus(str, Enum):
+    QUEUED = "queued"
+    PROCESSING = "processing"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+class IngestionJob(BaseModel):
+    id: str = Field(alias="_id")
+    chat_id: str
+    filename: str
+    status: JobStatus
+    stage: str  # queued, extracting, indexing, responding, committed, done or failed
+    progress: int = 0  # percent
+    error: Optional[str] = None
+    result: Optional[ChatResponse] = None  # the chat turn, once completed
+    created_at: datetime
+    updated_at: datetime
+
+    class Config:
+        populate_by_name = True
+
 class ChatListResponse(BaseModel):
     chats: List[Chat]
+    next_cursor: Optional[str] = None  # pass as `before` to fetch the next page
 
 class ChatHistoryResponse(BaseModel):
     chat: Chat
     messages: List[Message]
 
+class MessagePageResponse(BaseModel):
+    messages: List[Message]  # newest first
+    next_cursor: Optional[str] = None  # pass as `before` to fetch older messages
+
 class MessageRequest(BaseModel):
     question: str
 
@@ -113,16 +113,50 @@
 
 # ai_service = AIService()
 
-import base64
-from typing import List, Optional
+import asyncio
+from typing import AsyncIterator, List, Optional, Union
 from langchain_openai import AzureChatOpenAI
 from langchain.schema import HumanMessage, AIMessage, SystemMessage
 from config import settings
 from models import Message, MessageRole
+from services.semantic_cache import semantic_cache
+from services.vision_cache import vision_cache
 import logging
 
 logger = logging.getLogger(__name__)
 
+ERROR_RESPONSE = "I apologize, but I encountered an error while processing your request. Please try again."
+
+# Longest excerpt of a single message fed to the summarizer
+SUMMARY_MESSAGE_CHARS = 2000
+
+# One image path, or several for a batch upload
+ImagePaths = Optional[Union[str, List[str]]]
+
+
+class StreamInterrupted(Exception):
+    """The model stream failed after part of the answer was already sent"""
+
+
+def make_placeholder_title(first_message: str) -> str:
+    """Cheap local title from the first words of the opening message"""
+    first_line = next((line.strip() for line in first_message.splitlines() if line.strip()), "")
+    all_words = first_line.lstrip("#>*- ").split()
+    words = all_words[:6]
+    if not words:
+        return "New Chat"
+    title = " ".join(words)
+    if len(title) > 50:
+        title = title[:47].rstrip() + "..."
+    elif len(all_words) > len(words):
+        title += "..."
+    return title
+
+
+def format_summary(summary: str) -> str:
+    """Render a rolling summary as the context block sent to the model"""
+    return f"Summary of the earlier part of this conversation:\n{summary}"
+
 class AIService:
     def __init__(self):
         self.llm = AzureChatOpenAI(
@@ -133,6 +167,19 @@ class AIService:
             temperature=0.7,
             max_tokens=2000,
         )
+
+        # Titles only need a few tokens; route them to a smaller deployment when configured
+        if settings.azure_openai_title_deployment_name:
+            self.title_llm = AzureChatOpenAI(
+                azure_endpoint=settings.azure_openai_endpoint,
+                api_key=settings.azure_openai_api_key,
+                api_version=settings.azure_openai_api_version,
+                deployment_name=settings.azure_openai_title_deployment_name,
+                temperature=0.3,
+                max_tokens=30,
+            )
+        else:
+            self.title_llm = self.llm
         
         self.system_prompt = """आप एक सहायक AI सहायक हैं। आप केवल भारतीय भाषाओं में ही उत्तर देंगे 
 (जैसे हिंदी, तमिल, तेलुगु, बंगाली, मराठी, कन्नड़, मलयालम, पंजाबी, गुजराती आदि)।
@@ -147,58 +194,141 @@ class AIService:
 
 हमेशा भारतीय भाषाओं का प्रयोग करें। उपयोगकर्ता की भाषा पहचानकर उसी भाषा में उत्तर दें।"""
 
-    async def generate_response(self, messages: List[Message], image_path: Optional[str] = None) -> str:
+    async def _build_langchain_messages(self, messages: List[Message], image_path: ImagePaths = None,
+                                        summary: Optional[str] = None,
+                                        document_context: Optional[str] = None,
+                                        web_context: Optional[str] = None) -> list:
+        """Convert stored messages to LangChain format"""
+        langchain_messages = [SystemMessage(content=self.system_prompt)]
+        if summary:
+            langchain_messages.append(SystemMessage(content=format_summary(summary)))
+        if document_context:
+            langchain_messages.append(SystemMessage(content=document_context))
+        if web_context:
+            langchain_messages.append(SystemMessage(content=web_context))
+
+        for msg in messages:
+            if msg.role == MessageRole.USER:
+                if image_path and msg == messages[-1]:  # Latest message with image
+                    # Handle image input
+                    content = await self._create_image_message(msg.content, image_path)
+                    langchain_messages.append(HumanMessage(content=content))
+                else:
+                    langchain_messages.append(HumanMessage(content=msg.content))
+            else:
+                langchain_messages.append(AIMessage(content=msg.content))
+
+        return langchain_messages
+
+    def _semantic_cache_key(self, messages: List[Message], image_path: ImagePaths = None,
+                            summary: Optional[str] = None,
+                            document_context: Optional[str] = None,
+                            web_context: Optional[str] = None) -> Optional[str]:
+        """Text to look up in the semantic cache, or None if the prompt is not cacheable.
+
+        Only history-free (or, if configured, short-history) text prompts qualify;
+        images, summaries, documents and web-search results make the answer context specific.
+        """
+        if (not settings.semantic_cache_enabled or image_path or summary or document_context
+                or web_context or not messages):
+            return None
+        if messages[-1].role != MessageRole.USER:
+            return None
+        if len(messages) - 1 > settings.semantic_cache_max_history:
+            return None
+        if any(msg.role == MessageRole.SYSTEM for msg in messages):
+            return None
+        if len(messages) == 1:
+            return messages[0].content
+        # Earlier replies shape the answer too, so they are part of the key
+        return "\n".join(f"{msg.role.value}: {msg.content}" for msg in messages)
+
+    async def generate_response(self, messages: List[Message], image_path: ImagePaths = None,
+                                summary: Optional[str] = None,
+                                document_context: Optional[str] = None,
+                                web_context: Optional[str] = None) -> str:
         """Generate AI response based on conversation history"""
         try:
-            # Convert messages to LangChain format
-            langchain_messages = [SystemMessage(content=self.system_prompt)]
-            
-            for msg in messages:
-                if msg.role == MessageRole.USER:
-                    if image_path and msg == messages[-1]:  # Latest message with image
-                        # Handle image input
-                        content = await self._create_image_message(msg.content, image_path)
-                        langchain_messages.append(HumanMessage(content=content))
-                    else:
-                        langchain_messages.append(HumanMessage(content=msg.content))
-                else:
-                    langchain_messages.append(AIMessage(content=msg.content))
+            cache_key = self._semantic_cache_key(messages, image_path, summary, document_context, web_context)
+            embedding = None
+            if cache_key:
+                cached, embedding = await semantic_cache.lookup(cache_key)
+                if cached is not None:
+                    return cached
+
+            langchain_messages = await self._build_langchain_messages(
+                messages, image_path, summary, document_context, web_context
+            )
             
             # Generate response
             response = await self.llm.ainvoke(langchain_messages)
+
+            if cache_key and response.content:
+                await semantic_cache.store(cache_key, response.content, embedding)
             return response.content
             
         except Exception as e:
             logger.error(f"Error generating AI response: {e}")
-            return "I apologize, but I encountered an error while processing your request. Please try again."
+            return ERROR_RESPONSE
+
+    async def stream_response(self, messages: List[Message], image_path: ImagePaths = None,
+                              summary: Optional[str] = None,
+                              document_context: Optional[str] = None,
+                              web_context: Optional[str] = None) -> AsyncIterator[str]:
+        """Stream the AI response token by token as the model produces it.
 
-    async def _create_image_message(self, text_content: str, image_path: str) -> List[dict]:
-        """Create message content with image for vision model"""
+        Raises StreamInterrupted if the model fails after some tokens went out;
+        a failure before the first token yields the apology instead.
+        """
+        chunks = []
         try:
-            with open(image_path, "rb") as image_file:
-                image_data = base64.b64encode(image_file.read()).decode('utf-8')
-            
-            # Determine image type
-            image_type = "jpeg"
-            if image_path.lower().endswith('.png'):
-                image_type = "png"
-            elif image_path.lower().endswith('.gif'):
-                image_type = "gif"
-            elif image_path.lower().endswith('.webp'):
-                image_type = "webp"
-            
+            cache_key = self._semantic_cache_key(messages, image_path, summary, document_context, web_context)
+            embedding = None
+            if cache_key:
+                cached, embedding = await semantic_cache.lookup(cache_key)
+                if cached is not None:
+                    yield cached
+                    return
+
+            langchain_messages = await self._build_langchain_messages(
+                messages, image_path, summary, document_context, web_context
+            )
+
+            async for chunk in self.llm.astream(langchain_messages):
+                if chunk.content:
+                    chunks.append(chunk.content)
+                    yield chunk.content
+
+            if cache_key and chunks:
+                await semantic_cache.store(cache_key, "".join(chunks), embedding)
+
+        except Exception as e:
+            logger.error(f"Error streaming AI response: {e}")
+            # Only surface the apology if the client has not received a partial answer
+            if chunks:
+                raise StreamInterrupted(str(e)) from e
+            yield ERROR_RESPONSE
+
+    async def _create_image_message(self, text_content: str, image_path: Union[str, List[str]]) -> List[dict]:
+        """Create message content with image(s) for vision model"""
+        try:
+            image_paths = [image_path] if isinstance(image_path, str) else image_path
+            # Downscaled and encoded once per image, then reused
+            data_urls = await asyncio.gather(*(vision_cache.get_data_url(path) for path in image_paths))
+
             content = [
                 {
                     "type": "text",
                     "text": text_content or "Please describe this image."
-                },
-                {
+                }
+            ]
+            for data_url in data_urls:
+                content.append({
                     "type": "image_url",
                     "image_url": {
-                        "url": f"data:image/{image_type};base64,{image_data}"
+                        "url": data_url
                     }
-                }
-            ]
+                })
             
             return content
         except Exception as e:
@@ -210,12 +340,12 @@ class AIService:
         try:
             prompt = f"""Based on this conversation, generate a short, descriptive title (max 50 characters):
 
-User: {first_message}
+User: {first_message[:500]}
 Assistant: {response[:200]}...
 
 Generate only the title, nothing else."""
 
-            title_response = await self.llm.ainvoke([HumanMessage(content=prompt)])
+            title_response = await self.title_llm.ainvoke([HumanMessage(content=prompt)])
             title = title_response.content.strip().strip('"').strip("'")
             
             # Ensure title is not too long
@@ -226,7 +356,45 @@ Generate only the title, nothing else."""
         except Exception as e:
             logger.error(f"Error generating chat title: {e}")
             # Fallback to simple title generation
-            words = first_message.split()[:4]
-            return " ".join(words) + ("..." if len(words) >= 4 else "")
+            return make_placeholder_title(first_message)
+
+
+    async def summarize_conversation(self, previous_summary: Optional[str],
+                                     messages: List[Message]) -> Optional[str]:
+        """Fold new messages into the running summary of a conversation.
+
+        Only the new messages are sent alongside the previous summary, so the cost
+        of each update does not grow with the length of the chat. Returns None if
+        the model call fails so the caller can keep the old summary.
+        """
+        try:
+            lines = []
+            for msg in messages:
+                speaker = {
+                    MessageRole.USER: "User",
+                    MessageRole.ASSISTANT: "Assistant",
+                    MessageRole.SYSTEM: "Web results",
+                }[msg.role]
+                text = msg.content[:SUMMARY_MESSAGE_CHARS]
+                lines.append(f"{speaker}: {text}")
+            transcript = "\n\n".join(lines)
+
+            prompt = f"""You maintain a running summary of a conversation between a user and an assistant.
+
+Current summary:
+{previous_summary or "(empty)"}
+
+New messages:
+{transcript}
+
+Update the summary so it also covers the new messages. Keep facts, names, numbers, decisions, open questions and the user's preferences. Write it in the language of the conversation, in at most 250 words.
+
+Return only the updated summary."""
+
+            summary_response = await self.llm.ainvoke([HumanMessage(content=prompt)])
+            return summary_response.content.strip()
+        except Exception as e:
+            logger.error(f"Error summarizing conversation: {e}")
+            return None
 
 ai_service = AIService()
\ No newline at end of file
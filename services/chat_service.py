@@ -161,19 +161,127 @@
 
 
 
+import asyncio
 import uuid
-from typing import List, Optional
-from datetime import datetime
-from database import get_database
-from models import Chat, Message, MessageRole, FileInfo
-from services.ai_service import ai_service
+from dataclasses import dataclass
+from typing import AsyncIterator, List, Optional
+from datetime import datetime, timedelta
+from database import get_database, mongodb
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ReturnDocument
+from models import Chat, Message, MessageRole, FileInfo, Reference
+from services.ai_service import ai_service, format_summary, make_placeholder_title, ImagePaths, StreamInterrupted
+from services.context_builder import context_builder
+from services.task_runner import task_runner
+from services.history_cache import history_cache
+from services.pagination import encode_cursor, decode_cursor, before_filter
+from services.document_index import document_index
+from services.web_grounding import web_grounding
+from config import settings
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Fields the chat list needs; summaries and other per-chat state stay in Mongo
+CHAT_LIST_PROJECTION = {"title": 1, "created_at": 1, "updated_at": 1, "message_count": 1}
+# Fields that change whenever a chat is written, used to validate the history cache
+CHAT_VERSION_PROJECTION = {"_id": 0, "message_count": 1, "updated_at": 1, "summarized_until": 1}
+
+
+def _utcnow() -> datetime:
+    """Current UTC time at the millisecond precision MongoDB stores, so cached
+    messages compare exactly like the ones read back from the database"""
+    now = datetime.utcnow()
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+
+class ChatUnitOfWork:
+    """Collects the writes of one chat turn and flushes them together.
+
+    All new messages go out in a single ``insert_many`` and the chat document
+    gets a single ``$set``/``$inc``, optionally inside a transaction (which
+    needs a replica set). Nothing is written until ``commit``.
+    """
+
+    def __init__(self, db, chat_id: str, transactional: bool = False):
+        self.db = db
+        self.chat_id = chat_id
+        self.transactional = transactional
+        self.messages: List[Message] = []
+        self.chat_updates: dict = {}
+        self.committed = False
+
+    def add_message(self, role: MessageRole, content: str,
+                    file_info: Optional[FileInfo] = None,
+                    files: Optional[List[FileInfo]] = None,
+                    references: Optional[List[Reference]] = None) -> Message:
+        """Stage a message; timestamps strictly increase so the turn keeps its order"""
+        timestamp = _utcnow()
+        if self.messages and timestamp <= self.messages[-1].timestamp:
+            timestamp = self.messages[-1].timestamp + timedelta(milliseconds=1)
+        message = Message(
+            chat_id=self.chat_id,
+            role=role,
+            content=content,
+            references=references,
+            file=file_info,
+            files=files,
+            timestamp=timestamp
+        )
+        self.messages.append(message)
+        return message
+
+    def set_title(self, title: str):
+        self.chat_updates["title"] = title
+
+    async def _write(self, updated_at: datetime, session=None):
+        if self.messages:
+            await self.db.messages.insert_many(
+                [message.model_dump() for message in self.messages], session=session
+            )
+        update = {"$set": {"updated_at": updated_at, **self.chat_updates}}
+        if self.messages:
+            update["$inc"] = {"message_count": len(self.messages)}
+        await self.db.chats.update_one({"_id": self.chat_id}, update, session=session)
+
+    async def commit(self):
+        """Write all staged changes and update the history cache"""
+        if self.committed or (not self.messages and not self.chat_updates):
+            return
+        self.committed = True
+        # Stored and cached alike, so the cache validates against this worker's own writes
+        updated_at = self.messages[-1].timestamp if self.messages else _utcnow()
+
+        if self.transactional and mongodb.client is not None:
+            async with await mongodb.client.start_session() as session:
+                async with session.start_transaction():
+                    await self._write(updated_at, session)
+        else:
+            await self._write(updated_at)
+
+        for message in self.messages:
+            history_cache.append_message(self.chat_id, message)
+        if self.chat_updates:
+            history_cache.update_chat(self.chat_id, updated_at=updated_at, **self.chat_updates)
+
+
+@dataclass
+class PreparedTurn:
+    uow: ChatUnitOfWork
+    user_message: Message
+    messages: List[Message]  # context to send, trimmed to the token budget
+    summary: Optional[str]
+    is_first_turn: bool
+    document_context: Optional[str] = None  # passages retrieved from the chat's documents
+    web_context: Optional[str] = None  # passages of web pages read for this turn
+    references: Optional[List[Reference]] = None  # the web pages, stored on the AI message
+
+
 class ChatService:
     def __init__(self):
         self.db = None
+        self._summarizing = set()  # chat ids with a summary update in flight
     
     def get_db(self):
         if self.db is None:
@@ -183,11 +291,12 @@ class ChatService:
     async def create_chat(self, title: str = "New Chat") -> Chat:
         """Create a new chat session"""
         chat_id = str(uuid.uuid4())
+        now = _utcnow()
         chat = Chat(
             id=chat_id,
             title=title,
-            created_at=datetime.utcnow(),
-            updated_at=datetime.utcnow(),
+            created_at=now,
+            updated_at=now,
             message_count=0
         )
         
@@ -196,26 +305,60 @@ class ChatService:
         chat_dict["_id"] = chat_id  # Ensure _id is set correctly
         await db.chats.insert_one(chat_dict)
         
+        history_cache.put_chat(chat)
+        history_cache.put_messages(chat_id, [])
+        
         logger.info(f"Created new chat: {chat_id}")
         return chat
 
-    async def get_all_chats(self) -> List[Chat]:
-        """Get all chat sessions"""
+    async def get_all_chats(self, limit: int = 50,
+                            before: Optional[str] = None) -> tuple[List[Chat], Optional[str]]:
+        """Get one page of chat sessions, most recently active first.
+
+        Returns the chats and a cursor for the next page (None on the last page).
+        Raises ValueError for a malformed ``before`` cursor.
+        """
         db = self.get_db()
-        cursor = db.chats.find().sort("updated_at", -1)
+        query = {}
+        if before:
+            updated_at, chat_id = decode_cursor(before)
+            query = before_filter("updated_at", updated_at, chat_id)
+
+        cursor = (
+            db.chats.find(query, CHAT_LIST_PROJECTION)
+            .sort([("updated_at", -1), ("_id", -1)])
+            .limit(limit + 1)
+        )
         chats = []
         
         async for chat_doc in cursor:
             # Handle MongoDB _id field
-            if "_id" in chat_doc:
-                chat_doc["id"] = chat_doc["_id"]
-            chat = Chat(**chat_doc)
-            chats.append(chat)
-        
-        return chats
+            chat_doc["id"] = chat_doc.pop("_id")
+            chats.append(Chat.model_construct(**chat_doc))
+        
+        next_cursor = None
+        if len(chats) > limit:
+            chats = chats[:limit]
+            next_cursor = encode_cursor(chats[-1].updated_at, chats[-1].id)
+        return chats, next_cursor
+
+    async def _cache_is_current(self, chat_id: str) -> bool:
+        """Check the cached chat against the stored one, which another worker may have changed"""
+        db = self.get_db()
+        version = await db.chats.find_one({"_id": chat_id}, CHAT_VERSION_PROJECTION)
+        if version is None:
+            history_cache.invalidate(chat_id)
+            return False
+        return history_cache.is_current(
+            chat_id, version.get("message_count", 0), version.get("updated_at"), version.get("summarized_until")
+        )
 
     async def get_chat(self, chat_id: str) -> Optional[Chat]:
         """Get a specific chat"""
+        chat = history_cache.get_chat(chat_id)
+        if chat is not None and await self._cache_is_current(chat_id):
+            return chat
+
         db = self.get_db()
         chat_doc = await db.chats.find_one({"_id": chat_id})
         
@@ -223,59 +366,101 @@ class ChatService:
             # Handle MongoDB _id field
             if "_id" in chat_doc:
                 chat_doc["id"] = chat_doc["_id"]
-            return Chat(**chat_doc)
+            chat = Chat(**chat_doc)
+            history_cache.put_chat(chat)
+            return chat
         return None
 
-    async def get_chat_messages(self, chat_id: str) -> List[Message]:
-        """Get all messages for a chat"""
+    async def get_chat_messages(self, chat_id: str, since: Optional[datetime] = None) -> List[Message]:
+        """Get all messages for a chat, optionally only those newer than since"""
+        cached = history_cache.get_messages(chat_id, since)
+        if cached is not None and await self._cache_is_current(chat_id):
+            return cached
+
         db = self.get_db()
-        cursor = db.messages.find({"chat_id": chat_id}).sort("timestamp", 1)
+        query = {"chat_id": chat_id}
+        if since is not None:
+            query["timestamp"] = {"$gt": since}
+        cursor = db.messages.find(query).sort("timestamp", 1)
         messages = []
         
         async for msg_doc in cursor:
             message = Message(**msg_doc)
             messages.append(message)
         
+        history_cache.put_messages(chat_id, messages, since)
         return messages
 
+    async def get_message_page(self, chat_id: str, limit: int = 50,
+                               before: Optional[str] = None) -> tuple[List[Message], Optional[str]]:
+        """Get one page of a chat's messages, newest first.
+
+        Returns the messages and a cursor for the next (older) page, or None when
+        there are no older messages. Raises ValueError for a malformed cursor.
+        """
+        db = self.get_db()
+        query = {"chat_id": chat_id}
+        if before:
+            timestamp, message_id = decode_cursor(before)
+            try:
+                message_id = ObjectId(message_id)
+            except InvalidId as e:
+                raise ValueError(f"Invalid cursor: {before}") from e
+            query.update(before_filter("timestamp", timestamp, message_id))
+
+        cursor = (
+            db.messages.find(query)
+            .sort([("timestamp", -1), ("_id", -1)])
+            .limit(limit + 1)
+        )
+        docs = await cursor.to_list(length=limit + 1)
+
+        next_cursor = None
+        if len(docs) > limit:
+            docs = docs[:limit]
+            next_cursor = encode_cursor(docs[-1]["timestamp"], docs[-1]["_id"])
+        return [Message(**doc) for doc in docs], next_cursor
+
+    async def iter_chat_messages(self, chat_id: str, batch_size: int = 100) -> AsyncIterator[Message]:
+        """Yield a chat's messages oldest first straight from the Mongo cursor,
+        without holding the whole history in memory"""
+        db = self.get_db()
+        cursor = db.messages.find({"chat_id": chat_id}).sort("timestamp", 1).batch_size(batch_size)
+        async for msg_doc in cursor:
+            yield Message(**msg_doc)
+
+    def unit_of_work(self, chat_id: str) -> ChatUnitOfWork:
+        """Start batching the writes of a chat turn"""
+        return ChatUnitOfWork(self.get_db(), chat_id, transactional=settings.mongodb_use_transactions)
+
     async def add_message(self, chat_id: str, role: MessageRole, content: str, 
                          file_info: Optional[FileInfo] = None) -> Message:
         """Add a message to a chat"""
-        message = Message(
-            chat_id=chat_id,
-            role=role,
-            content=content,
-            file=file_info,
-            timestamp=datetime.utcnow()
-        )
-        
-        db = self.get_db()
-        await db.messages.insert_one(message.model_dump())
-        
-        # Update chat's updated_at and message count
-        await db.chats.update_one(
-            {"_id": chat_id},
-            {
-                "$set": {"updated_at": datetime.utcnow()},
-                "$inc": {"message_count": 1}
-            }
-        )
-        
+        uow = self.unit_of_work(chat_id)
+        message = uow.add_message(role, content, file_info)
+        await uow.commit()
         return message
 
-    async def rename_chat(self, chat_id: str, new_title: str) -> bool:
-        """Rename a chat"""
+    async def rename_chat(self, chat_id: str, new_title: str,
+                          expected_title: Optional[str] = None) -> bool:
+        """Rename a chat, optionally only if its title is still expected_title"""
         db = self.get_db()
+        updated_at = _utcnow()
+        query = {"_id": chat_id}
+        if expected_title is not None:
+            query["title"] = expected_title
         result = await db.chats.update_one(
-            {"_id": chat_id},
+            query,
             {
                 "$set": {
                     "title": new_title,
-                    "updated_at": datetime.utcnow()
+                    "updated_at": updated_at
                 }
             }
         )
         
+        if result.modified_count:
+            history_cache.update_chat(chat_id, title=new_title, updated_at=updated_at)
         return result.modified_count > 0
 
     async def delete_chat(self, chat_id: str) -> bool:
@@ -287,44 +472,237 @@ class ChatService:
         
         # Delete chat
         result = await db.chats.delete_one({"_id": chat_id})
+        history_cache.invalidate(chat_id)
         
         logger.info(f"Deleted chat: {chat_id}")
         return result.deleted_count > 0
 
-    async def process_message(self, chat_id: str, content: str,
-                               original_content: Optional[str] = None,  # the actual user input 
+    async def attach_document(self, chat_id: str, sha256: str):
+        """Let a chat retrieve from an indexed document"""
+        db = self.get_db()
+        chat_doc = await db.chats.find_one_and_update(
+            {"_id": chat_id},
+            {"$addToSet": {"document_hashes": sha256}},
+            projection={"document_hashes": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        if chat_doc is not None:
+            history_cache.update_chat(chat_id, document_hashes=chat_doc["document_hashes"])
+
+    async def _prepare_turn(self, chat_id: str, content: str,
+                            original_content: Optional[str] = None,
                             file_info: Optional[FileInfo] = None,
-                            web_search_results: Optional[str] = None,  # ✅ new arg (optional)
-                            image_path: Optional[str] = None) -> tuple[Message, Message]:
-        """Process a user message and generate AI response"""
+                            web_search_results: Optional[str] = None,
+                            files: Optional[List[FileInfo]] = None,
+                            ground_on_web: bool = False) -> PreparedTurn:
+        """Stage the user side of a turn and build the context to send to the model.
+
+        The user (and web search) messages are only staged on the turn's unit of
+        work; they are written together with the AI response in _finalize_turn.
+        With ``ground_on_web`` the question is also searched and the result pages
+        read server-side; their passages are sent for this turn only and the
+        pages are kept as references on the AI message.
+        """
+        # Grounding is the slowest lookup, so it runs while the rest is prepared
+        grounding_task = None
+        if ground_on_web and settings.web_grounding_enabled:
+            grounding_task = asyncio.create_task(web_grounding.ground(original_content or content))
+
+        chat = await self.get_chat(chat_id)
+        summary = chat.summary if chat else None
+        summarized_until = chat.summarized_until if chat else None
+
+        # Passages of the chat's uploaded documents relevant to this question
+        document_context = None
+        if chat and chat.document_hashes and settings.document_index_enabled:
+            document_context = await document_index.retrieve(
+                chat.document_hashes, original_content or content
+            )
+
+        # Get the conversation history not yet folded into the summary
+        messages = await self.get_chat_messages(chat_id, since=summarized_until)
+
+        uow = self.unit_of_work(chat_id)
         # Add user message
-        user_message = await self.add_message(chat_id, MessageRole.USER, original_content or content, file_info)
+        user_message = uow.add_message(MessageRole.USER, original_content or content, file_info, files)
 
-            # 2. Optional: Save web search results as a system message
+        # Optional: Save web search results as a system message
         if web_search_results:
-            await self.add_message(
-                chat_id,
-                MessageRole.SYSTEM,
-                web_search_results
+            uow.add_message(MessageRole.SYSTEM, web_search_results)
+
+        messages.extend(uow.messages)
+        is_first_turn = summarized_until is None and len(messages) <= 2  # First user message (+ web search results)
+
+        grounding = await grounding_task if grounding_task else None
+
+        extra_system = [format_summary(summary)] if summary else []
+        if document_context:
+            extra_system.append(document_context)
+        if grounding:
+            extra_system.append(grounding.context)
+        window = context_builder.build(
+            messages,
+            system_prompt=ai_service.system_prompt,
+            extra_system=extra_system,
+        )
+        if window.dropped_messages:
+            logger.info(
+                f"Trimmed chat {chat_id} context: dropped {window.dropped_messages} messages "
+                f"({window.dropped_tokens} tokens), sending {window.total_tokens} tokens"
             )
-        
-        # Get conversation history
-        messages = await self.get_chat_messages(chat_id)
+        self._schedule_summary_update(chat_id, len(messages) + 1)  # + the AI response
+        return PreparedTurn(
+            uow=uow,
+            user_message=user_message,
+            messages=window.messages,
+            summary=summary,
+            is_first_turn=is_first_turn,
+            document_context=document_context,
+            web_context=grounding.context if grounding else None,
+            references=grounding.references if grounding else None,
+        )
+
+    async def _finalize_turn(self, chat_id: str, content: str, turn: PreparedTurn,
+                             ai_response_content: str) -> Message:
+        """Store the whole turn and title the chat after its first exchange"""
+        # Add AI response
+        ai_message = turn.uow.add_message(MessageRole.ASSISTANT, ai_response_content,
+                                          references=turn.references)
+
+        # Auto-generate title for first message: a local placeholder right away,
+        # the model-written title in the background
+        placeholder = None
+        if turn.is_first_turn:
+            placeholder = make_placeholder_title(content)
+            turn.uow.set_title(placeholder)
+
+        await turn.uow.commit()
+
+        if placeholder:
+            task_runner.submit(
+                self._generate_title(chat_id, content, ai_response_content, placeholder),
+                name=f"title-{chat_id}",
+            )
+
+        return ai_message
+
+    async def _generate_title(self, chat_id: str, content: str, ai_response_content: str,
+                              placeholder: str):
+        """Replace the placeholder title with a model-written one"""
+        try:
+            title = await ai_service.generate_chat_title(content, ai_response_content)
+            # Leave the chat alone if the user renamed it in the meantime
+            await self.rename_chat(chat_id, title, expected_title=placeholder)
+        except Exception as e:
+            logger.error(f"Error generating chat title: {e}")
+
+    def _schedule_summary_update(self, chat_id: str, unsummarized_count: int):
+        """Start a background summary update once the un-summarized tail is long enough"""
+        if unsummarized_count < settings.summary_trigger_messages + settings.summary_keep_recent_messages:
+            return
+        if chat_id in self._summarizing:
+            return
+        self._summarizing.add(chat_id)
+        task_runner.submit(self._update_summary(chat_id), name=f"summarize-{chat_id}")
+
+    async def _update_summary(self, chat_id: str):
+        """Fold the oldest un-summarized turns into the chat's rolling summary"""
+        try:
+            chat = await self.get_chat(chat_id)
+            if not chat:
+                return
+            messages = await self.get_chat_messages(chat_id, since=chat.summarized_until)
+
+            # Keep the newest messages verbatim and only cut at the end of a turn
+            cut = len(messages) - settings.summary_keep_recent_messages
+            while cut > 0 and messages[cut - 1].role != MessageRole.ASSISTANT:
+                cut -= 1
+            if cut < settings.summary_trigger_messages:
+                return
+
+            new_messages = messages[:cut]
+            summary = await ai_service.summarize_conversation(chat.summary, new_messages)
+            if not summary:
+                return
+
+            # Only apply if no other worker advanced the summary in the meantime
+            db = self.get_db()
+            summarized_until = new_messages[-1].timestamp
+            result = await db.chats.update_one(
+                {"_id": chat_id, "summarized_until": chat.summarized_until},
+                {"$set": {"summary": summary, "summarized_until": summarized_until}}
+            )
+            if result.modified_count:
+                history_cache.update_chat(chat_id, summary=summary, summarized_until=summarized_until)
+            else:
+                # Another worker advanced it first; our cached summary is behind
+                history_cache.invalidate(chat_id)
+            logger.info(f"Updated summary of chat {chat_id} with {len(new_messages)} messages")
+        finally:
+            self._summarizing.discard(chat_id)
+
+    async def process_message(self, chat_id: str, content: str,
+                               original_content: Optional[str] = None,  # the actual user input 
+                            file_info: Optional[FileInfo] = None,
+                            web_search_results: Optional[str] = None,  # ✅ new arg (optional)
+                            image_path: ImagePaths = None,
+                            files: Optional[List[FileInfo]] = None,
+                            ground_on_web: bool = False) -> tuple[Message, Message]:
+        """Process a user message and generate AI response"""
+        turn = await self._prepare_turn(
+            chat_id, content, original_content, file_info, web_search_results, files, ground_on_web
+        )
         
         # Generate AI response
-        ai_response_content = await ai_service.generate_response(messages, image_path)
-        
-        # Add AI response
-        ai_message = await self.add_message(chat_id, MessageRole.ASSISTANT, ai_response_content)
+        ai_response_content = await ai_service.generate_response(
+            turn.messages, image_path, turn.summary, turn.document_context, turn.web_context
+        )
         
-        # Auto-generate title for first message
-        if len(messages) <= 2:  # First user message + AI response
+        ai_message = await self._finalize_turn(chat_id, content, turn, ai_response_content)
+        return turn.user_message, ai_message
+
+    async def stream_message(self, chat_id: str, content: str,
+                             original_content: Optional[str] = None,
+                             file_info: Optional[FileInfo] = None,
+                             web_search_results: Optional[str] = None,
+                             image_path: ImagePaths = None,
+                             ground_on_web: bool = False) -> AsyncIterator[dict]:
+        """Process a user message and stream the AI response as events.
+
+        Yields a ``user_message`` event, one ``token`` event per chunk from the
+        model and a final ``done`` event carrying the persisted AI message. The
+        user message is written together with the AI message, so it is sent with
+        ``stored: False`` and is only stored once ``done`` (``stored: True``)
+        arrives. If the model fails mid-answer, the partial answer is stored and
+        ``done`` has ``incomplete: True``. If the client goes away mid-stream,
+        the turn is still stored with the partial answer.
+        """
+        turn = await self._prepare_turn(
+            chat_id, content, original_content, file_info, web_search_results,
+            ground_on_web=ground_on_web
+        )
+        chunks = []
+        incomplete = False
+        try:
+            yield {"type": "user_message", "message": turn.user_message, "stored": False}
+
             try:
-                title = await ai_service.generate_chat_title(content, ai_response_content)
-                await self.rename_chat(chat_id, title)
-            except Exception as e:
-                logger.error(f"Error generating chat title: {e}")
-        
-        return user_message, ai_message
+                async for token in ai_service.stream_response(
+                    turn.messages, image_path, turn.summary, turn.document_context, turn.web_context
+                ):
+                    chunks.append(token)
+                    yield {"type": "token", "content": token}
+            except StreamInterrupted:
+                incomplete = True
+
+            ai_message = await self._finalize_turn(chat_id, content, turn, "".join(chunks))
+            yield {"type": "done", "message": ai_message, "stored": True, "incomplete": incomplete}
+        finally:
+            if not turn.uow.committed:
+                # Cannot await while the generator is being closed; hand the write off
+                task_runner.submit(
+                    self._finalize_turn(chat_id, content, turn, "".join(chunks)),
+                    name=f"finalize-{chat_id}",
+                )
 
 chat_service = ChatService()
\ No newline at end of file
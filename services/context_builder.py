@@ -0,0 +1,147 @@
+import asyncio
+import threading
+import time
+from dataclasses import dataclass
+from typing import List, Optional, Sequence
+from config import settings
+from models import Message, MessageRole
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Fixed per-message cost of the chat format (role markers, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+# Every reply is primed with <|start|>assistant<|message|>
+REPLY_PRIMING_TOKENS = 3
+# How long to wait before trying to load the tokenizer again after a failure
+ENCODING_RETRY_SECONDS = 60
+
+
+@dataclass
+class ContextWindow:
+    messages: List[Message]
+    total_tokens: int
+    dropped_messages: int = 0
+    dropped_tokens: int = 0
+
+
+class ContextBuilder:
+    """Fits a conversation into a token budget for the chat model.
+
+    The system prompt and the current turn (the newest user message plus any
+    system/web-search messages stored with it) are always kept; older turns are
+    added newest-first until the budget is used up.
+    """
+
+    def __init__(self, model_name: str = "gpt-4o"):
+        self.model_name = model_name
+        self._encoding = None
+        self._loading = threading.Lock()
+        self._retry_at = 0.0  # monotonic time before which a failed load is not retried
+
+    async def start(self):
+        """Load the tokenizer off the event loop; tiktoken downloads it on a cold start"""
+        await asyncio.to_thread(self._load_encoding)
+
+    def _load_encoding(self):
+        if not self._loading.acquire(blocking=False):
+            return  # already being loaded
+        try:
+            import tiktoken
+            try:
+                self._encoding = tiktoken.encoding_for_model(self.model_name)
+            except KeyError:
+                self._encoding = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            self._retry_at = time.monotonic() + ENCODING_RETRY_SECONDS
+            logger.warning(f"tiktoken unavailable, estimating token counts for now: {e}")
+        finally:
+            self._loading.release()
+
+    def _get_encoding(self):
+        if self._encoding is None and time.monotonic() >= self._retry_at:
+            # Never load on the caller's thread, which is usually the event loop
+            self._retry_at = time.monotonic() + ENCODING_RETRY_SECONDS
+            threading.Thread(target=self._load_encoding, name="tiktoken-load", daemon=True).start()
+        return self._encoding
+
+    @staticmethod
+    def _estimate_quarters(ch: str) -> int:
+        # About 4 ASCII characters per token; other scripts (Indic, CJK) take
+        # a token or more per character, so count them as a full token
+        return 1 if ch < "\x80" else 4
+
+    def count_tokens(self, text: str) -> int:
+        """Count the tokens in a piece of text"""
+        if not text:
+            return 0
+        encoding = self._get_encoding()
+        if encoding is None:
+            return sum(self._estimate_quarters(ch) for ch in text) // 4 + 1
+        return len(encoding.encode(text, disallowed_special=()))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Cut text down to at most max_tokens tokens"""
+        if self.count_tokens(text) <= max_tokens:
+            return text
+        encoding = self._get_encoding()
+        if encoding is None:
+            budget = max(0, max_tokens - 1) * 4
+            used = 0
+            for i, ch in enumerate(text):
+                used += self._estimate_quarters(ch)
+                if used > budget:
+                    return text[:i]
+            return text
+        return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+
+    def count_message_tokens(self, message: Message) -> int:
+        """Count the tokens a stored message costs in the prompt"""
+        return self.count_tokens(message.content) + MESSAGE_OVERHEAD_TOKENS
+
+    def build(self, messages: List[Message], system_prompt: str = "",
+              extra_system: Sequence[str] = (),
+              max_tokens: Optional[int] = None) -> ContextWindow:
+        """Select the messages to send so the prompt stays within max_tokens.
+
+        ``extra_system`` holds additional system blocks (e.g. the rolling summary)
+        that are always sent and therefore count against the budget up front.
+        """
+        budget = max_tokens or settings.context_max_tokens
+        used = REPLY_PRIMING_TOKENS
+        for text in (system_prompt, *extra_system):
+            if text:
+                used += self.count_tokens(text) + MESSAGE_OVERHEAD_TOKENS
+
+        # The current turn starts after the last assistant reply
+        turn_start = len(messages)
+        while turn_start > 0 and messages[turn_start - 1].role != MessageRole.ASSISTANT:
+            turn_start -= 1
+
+        pinned = messages[turn_start:]
+        used += sum(self.count_message_tokens(m) for m in pinned)
+        if used > budget:
+            logger.warning(f"Current turn alone needs {used} tokens (budget {budget})")
+
+        # Walk older history newest-first and stop at the first message that does not fit,
+        # so the kept history is always a contiguous tail of the conversation
+        kept_from = turn_start
+        for index in range(turn_start - 1, -1, -1):
+            cost = self.count_message_tokens(messages[index])
+            if used + cost > budget:
+                break
+            used += cost
+            kept_from = index
+
+        dropped = messages[:kept_from]
+        dropped_tokens = sum(self.count_message_tokens(m) for m in dropped)
+
+        return ContextWindow(
+            messages=messages[kept_from:],
+            total_tokens=used,
+            dropped_messages=len(dropped),
+            dropped_tokens=dropped_tokens,
+        )
+
+
+context_builder = ContextBuilder()
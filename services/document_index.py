@@ -0,0 +1,174 @@
+import asyncio
+import time
+from typing import List, Optional
+import chromadb
+from config import settings
+from services.context_builder import context_builder
+from services.extraction_pool import extraction_pool
+from services.file_processor import _extract_chunks_job
+import logging
+
+logger = logging.getLogger(__name__)
+
+COLLECTION_NAME = "document_chunks"
+
+# FileProcessor result types whose full text is indexed
+INDEXED_FILE_TYPES = {"pdf", "word", "text"}
+
+
+def format_document_context(passages: List[dict]) -> str:
+    """Render retrieved passages as the context block sent to the model"""
+    parts = [
+        f"[{p['filename']}, part {p['chunk'] + 1}]\n{p['text']}"
+        for p in passages
+    ]
+    return "Relevant passages from the documents uploaded to this chat:\n\n" + "\n\n".join(parts)
+
+
+class DocumentIndex:
+    """Local vector index of uploaded documents, used to answer questions about them.
+
+    At upload the full text is split with FileProcessor.text_splitter (in the
+    extraction pool), embedded in batches and stored in a persistent Chroma
+    collection. Chunks are keyed by the document's content hash, so a file
+    uploaded to several chats is only indexed once; each chat keeps the list of
+    hashes it may retrieve from.
+
+    ``embedder`` is anything with an async ``aembed_documents``/``aembed_query``
+    pair; it defaults to the shared Azure embeddings client.
+    """
+
+    def __init__(self, path: str, embedder=None, batch_size: int = 64):
+        self.path = path
+        self.batch_size = batch_size
+        self._embedder = embedder
+        self._collection = None
+
+        self.documents_indexed = 0
+        self.chunks_indexed = 0
+        self.already_indexed = 0
+        self.retrievals = 0
+        self.errors = 0
+        self._index_seconds = 0.0
+        self._retrieval_seconds = 0.0
+
+    @property
+    def embedder(self):
+        if self._embedder is None:
+            from services.embeddings import get_embeddings
+            self._embedder = get_embeddings()
+        return self._embedder
+
+    @property
+    def collection(self):
+        if self._collection is None:
+            client = chromadb.PersistentClient(
+                path=self.path,
+                settings=chromadb.config.Settings(anonymized_telemetry=False),
+            )
+            # Embeddings are computed here, not by Chroma's default model
+            self._collection = client.get_or_create_collection(
+                COLLECTION_NAME,
+                embedding_function=None,
+                metadata={"hnsw:space": "cosine"},
+            )
+        return self._collection
+
+    async def is_indexed(self, sha256: str) -> bool:
+        # Chunk 0 is written last, so its presence means the whole document is in
+        result = await asyncio.to_thread(self.collection.get, ids=[f"{sha256}:0"], include=[])
+        return bool(result["ids"])
+
+    async def index_document(self, sha256: str, filename: str, file_path: str) -> bool:
+        """Chunk, embed and store a document; returns True if it can be retrieved from"""
+        started = time.perf_counter()
+        try:
+            if await self.is_indexed(sha256):
+                self.already_indexed += 1
+                return True
+
+            chunks = await extraction_pool.run(_extract_chunks_job, file_path, filename)
+            if not chunks:
+                return False
+
+            starts = list(range(0, len(chunks), self.batch_size))
+            for start in starts[1:] + starts[:1]:
+                batch = chunks[start:start + self.batch_size]
+                embeddings = await self.embedder.aembed_documents(batch)
+                await asyncio.to_thread(
+                    self.collection.upsert,
+                    ids=[f"{sha256}:{start + i}" for i in range(len(batch))],
+                    embeddings=embeddings,
+                    documents=batch,
+                    metadatas=[
+                        {"doc_hash": sha256, "filename": filename, "chunk": start + i}
+                        for i in range(len(batch))
+                    ],
+                )
+
+            self.documents_indexed += 1
+            self.chunks_indexed += len(chunks)
+            logger.info(f"Indexed {filename} ({sha256[:12]}): {len(chunks)} chunks")
+            return True
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Error indexing document {filename}: {e}")
+            return False
+        finally:
+            self._index_seconds += time.perf_counter() - started
+
+    async def retrieve(self, doc_hashes: List[str], query: str,
+                       max_tokens: Optional[int] = None, k: Optional[int] = None) -> Optional[str]:
+        """Most relevant passages of the given documents for query, within max_tokens.
+
+        Returns the formatted context block, or None if nothing was found.
+        """
+        if not doc_hashes or not query.strip():
+            return None
+        max_tokens = max_tokens or settings.document_context_max_tokens
+        k = k or settings.document_retrieval_top_k
+
+        started = time.perf_counter()
+        try:
+            query_embedding = await self.embedder.aembed_query(query)
+            where = {"doc_hash": doc_hashes[0]} if len(doc_hashes) == 1 else {"doc_hash": {"$in": doc_hashes}}
+            result = await asyncio.to_thread(
+                self.collection.query,
+                query_embeddings=[query_embedding],
+                n_results=k,
+                where=where,
+                include=["documents", "metadatas"],
+            )
+            self.retrievals += 1
+
+            passages = []
+            used_tokens = 0
+            for text, metadata in zip(result["documents"][0], result["metadatas"][0]):
+                tokens = context_builder.count_tokens(text)
+                if used_tokens + tokens > max_tokens:
+                    break
+                used_tokens += tokens
+                passages.append({"text": text, "filename": metadata["filename"], "chunk": metadata["chunk"]})
+            return format_document_context(passages) if passages else None
+        except Exception as e:
+            # Retrieval must never fail a chat turn
+            self.errors += 1
+            logger.warning(f"Document retrieval failed: {e}")
+            return None
+        finally:
+            self._retrieval_seconds += time.perf_counter() - started
+
+    def stats(self) -> dict:
+        return {
+            "enabled": settings.document_index_enabled,
+            "documents_indexed": self.documents_indexed,
+            "chunks_indexed": self.chunks_indexed,
+            "already_indexed": self.already_indexed,
+            "retrievals": self.retrievals,
+            "errors": self.errors,
+            "avg_retrieval_ms": round(self._retrieval_seconds / self.retrievals * 1000, 2) if self.retrievals else 0.0,
+            "index_seconds_total": round(self._index_seconds, 2),
+        }
+
+
+document_index = DocumentIndex(settings.vector_store_dir, batch_size=settings.embedding_batch_size)
@@ -0,0 +1,14 @@
+from functools import lru_cache
+from langchain_openai import AzureOpenAIEmbeddings
+from config import settings
+
+
+@lru_cache(maxsize=1)
+def get_embeddings() -> AzureOpenAIEmbeddings:
+    """Shared client for the configured Azure OpenAI embedding deployment"""
+    return AzureOpenAIEmbeddings(
+        azure_endpoint=settings.azure_openai_endpoint,
+        api_key=settings.azure_openai_api_key,
+        api_version=settings.azure_openai_api_version,
+        azure_deployment=settings.azure_openai_embedding_deployment_name,
+    )
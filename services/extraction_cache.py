@@ -0,0 +1,84 @@
+from datetime import datetime
+from typing import Optional, Tuple
+from database import get_database
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever FileProcessor output changes, so stale extractions are not reused
+EXTRACTION_VERSION = 3
+
+
+def _rename_in_header(content: str, old_filename: str, new_filename: str) -> str:
+    """Swap the filename in the first line of a cached extraction ("PDF Document: x.pdf")"""
+    if old_filename == new_filename:
+        return content
+    header, sep, body = content.partition("\n")
+    return header.replace(old_filename, new_filename, 1) + sep + body
+
+
+class ExtractionCache:
+    """FileProcessor results stored in Mongo against the file's content hash.
+
+    Uploading a document that was seen before (in any chat) returns the
+    stored ``(processed_content, file_type)`` without parsing it again.
+    """
+
+    def __init__(self):
+        self.db = None
+        self.hits = 0
+        self.misses = 0
+
+    def get_db(self):
+        if self.db is None:
+            self.db = get_database()
+        return self.db
+
+    @staticmethod
+    def _key(sha256: str, extension: str) -> str:
+        # The extension decides which handler runs, so it is part of the key
+        return f"{sha256}{extension.lower()}:v{EXTRACTION_VERSION}"
+
+    async def get(self, sha256: str, extension: str, filename: str) -> Optional[Tuple[str, str]]:
+        db = self.get_db()
+        doc = await db.file_extractions.find_one(
+            {"_id": self._key(sha256, extension)},
+            {"processed_content": 1, "file_type": 1, "filename": 1},
+        )
+        if doc is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        content = _rename_in_header(doc["processed_content"], doc["filename"], filename)
+        return content, doc["file_type"]
+
+    async def put(self, sha256: str, extension: str, filename: str,
+                  processed_content: str, file_type: str):
+        # Errors may be transient (timeouts, worker crashes); only cache real results
+        if file_type == "error":
+            return
+        db = self.get_db()
+        try:
+            await db.file_extractions.update_one(
+                {"_id": self._key(sha256, extension)},
+                {"$setOnInsert": {
+                    "processed_content": processed_content,
+                    "file_type": file_type,
+                    "filename": filename,
+                    "created_at": datetime.utcnow(),
+                }},
+                upsert=True,
+            )
+        except Exception as e:
+            logger.warning(f"Could not cache extraction for {filename}: {e}")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+extraction_cache = ExtractionCache()
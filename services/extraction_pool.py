@@ -0,0 +1,186 @@
+import asyncio
+import multiprocessing
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Optional
+from config import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ExtractionError(Exception):
+    """An extraction job was lost because its worker pool broke or was recycled"""
+
+
+class ExtractionTimeout(ExtractionError):
+    """An extraction job ran longer than its timeout and its worker was recycled"""
+
+
+def _init_worker(memory_limit_mb: int):
+    """Cap the address space of each worker so one pathological file cannot take the host down"""
+    if not memory_limit_mb:
+        return
+    try:
+        import resource
+        limit = memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ImportError, ValueError, OSError) as e:  # not available on Windows
+        logging.getLogger(__name__).warning(f"Could not set worker memory limit: {e}")
+
+
+def _warm_up():
+    """No-op job used to spawn (and import modules in) workers ahead of real work"""
+    import services.file_processor  # noqa: F401
+
+
+class ExtractionPool:
+    """Bounded process pool for CPU-heavy, blocking document parsing.
+
+    Jobs are awaited from the event loop, so a large upload no longer blocks
+    other requests on the same worker. At most ``max_workers`` jobs run at once;
+    the rest wait their turn (reported as the queue depth). A job that exceeds
+    its timeout cannot be interrupted inside a worker process, so the pool is
+    torn down and recreated; jobs running alongside it fail with ExtractionError.
+    """
+
+    def __init__(self, max_workers: int = 2, timeout: float = 120,
+                 memory_limit_mb: int = 2048):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.restarts = 0
+        self._durations = deque(maxlen=500)
+
+    def start(self):
+        if self._executor is None:
+            # spawn: workers must not inherit the event loop, Mongo client or their threads
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.memory_limit_mb,),
+            )
+            # Spawning a worker and importing the parsers takes seconds; pay that
+            # cost now instead of inside the first upload's timeout
+            for _ in range(self.max_workers):
+                self._executor.submit(_warm_up)
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_workers)
+
+    def shutdown(self, wait: bool = True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=True)
+            self._executor = None
+
+    def _restart(self, executor: ProcessPoolExecutor):
+        """Kill the workers of executor (including a runaway one) and start a fresh pool.
+
+        Does nothing if executor was already replaced, so callers that all saw
+        the same broken pool restart it only once.
+        """
+        if self._executor is not executor:
+            return
+        self._executor = None
+        # ProcessPoolExecutor has no public way to stop a running job
+        for process in list(getattr(executor, "_processes", {}).values()):
+            process.terminate()
+        # Jobs of other callers still in this executor fail as a broken pool
+        # (ExtractionError) instead of being cancelled under them
+        executor.shutdown(wait=False)
+        self.restarts += 1
+        self.start()
+
+    async def run(self, fn: Callable, *args, timeout: Optional[float] = None):
+        """Run fn(*args) in a worker process and return its result.
+
+        ``fn`` and its arguments must be picklable (module-level functions).
+        Raises ExtractionTimeout if the job takes longer than the timeout and
+        ExtractionError if it was lost to a broken or recycled pool.
+        """
+        self.start()
+        timeout = timeout or self.timeout
+
+        self.queued += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.queued -= 1
+
+        self.running += 1
+        started = time.perf_counter()
+        try:
+            executor = self._executor
+            try:
+                future = executor.submit(fn, *args)
+            except BrokenProcessPool as e:
+                self._restart(executor)
+                raise ExtractionError("The extraction pool was restarted, please retry") from e
+            wrapped = asyncio.wrap_future(future)
+            try:
+                # asyncio.wait neither cancels the job on timeout nor turns a
+                # cancelled job into our own cancellation
+                done, _ = await asyncio.wait({wrapped}, timeout=timeout)
+            except asyncio.CancelledError:
+                future.cancel()  # the caller went away; drop the job if it has not started
+                raise
+            if not done:
+                # The job fails once its worker is killed; nobody is left to read that
+                wrapped.add_done_callback(lambda f: f.cancelled() or f.exception())
+                self.timed_out += 1
+                logger.error(f"Extraction job {getattr(fn, '__name__', fn)} timed out after {timeout}s")
+                self._restart(executor)
+                raise ExtractionTimeout(f"Processing took longer than {timeout:.0f} seconds")
+            if wrapped.cancelled():
+                raise ExtractionError("The extraction job was cancelled by a pool restart")
+            if isinstance(wrapped.exception(), BrokenProcessPool):
+                # A worker died (e.g. hit the memory cap) or another job's timeout
+                # recycled the pool; replace it for later jobs
+                self._restart(executor)
+                raise ExtractionError("The extraction worker stopped unexpectedly") from wrapped.exception()
+            result = wrapped.result()
+            self.completed += 1
+            return result
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self._durations.append(time.perf_counter() - started)
+            self.running -= 1
+            self._slots.release()
+
+    def stats(self) -> dict:
+        durations = sorted(self._durations)
+        def percentile(p: float) -> float:
+            if not durations:
+                return 0.0
+            return round(durations[min(len(durations) - 1, int(p * len(durations)))] * 1000, 1)
+        return {
+            "max_workers": self.max_workers,
+            "queue_depth": self.queued,
+            "running": self.running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "timed_out": self.timed_out,
+            "restarts": self.restarts,
+            "duration_ms_p50": percentile(0.5),
+            "duration_ms_p95": percentile(0.95),
+            "duration_ms_max": round(durations[-1] * 1000, 1) if durations else 0.0,
+        }
+
+
+extraction_pool = ExtractionPool(
+    max_workers=settings.extraction_workers,
+    timeout=settings.extraction_timeout_seconds,
+    memory_limit_mb=settings.extraction_memory_limit_mb,
+)
@@ -335,9 +335,11 @@
 
 
 import os
+import csv
+import codecs
 import logging
 import mimetypes
-from typing import Tuple
+from typing import Iterator, List, Tuple
 
 # ---------- Optional python-magic (libmagic is often missing on Azure) ----------
 try:
@@ -348,27 +350,35 @@ except Exception:
     HAS_MAGIC = False
 
 import pandas as pd
+from charset_normalizer import from_bytes
 from PIL import Image, UnidentifiedImageError
 from pptx import Presentation
 from docx import Document as DocxDocument  # NEW: robust DOCX reader (pip install python-docx)
+from pypdf import PdfReader
 
 # ---------- LangChain loaders (v0.3+ first, fallback to older paths) ----------
 try:
     from langchain_community.document_loaders import (
-        PyPDFLoader,
         TextLoader,
         UnstructuredWordDocumentLoader,
     )
 except Exception:  # fallback for older langchain installs
-    from langchain.document_loaders import PyPDFLoader, TextLoader  # type: ignore
+    from langchain.document_loaders import TextLoader  # type: ignore
     from langchain.document_loaders.word_document import (  # type: ignore
         UnstructuredWordDocumentLoader,
     )
 
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
+from config import settings
+from services.extraction_pool import extraction_pool, ExtractionTimeout
+from services.extraction_cache import extraction_cache
+from services.tabular_profile import ColumnProfiler, unique_headers
+
 logger = logging.getLogger(__name__)
 
+PREVIEW_CHARS = 2000  # characters of a document shown in the upload message
+
 
 # ---- Robust fallback by file extension (when magic/mimetypes are unreliable) ----
 def guess_type_by_extension(filename: str) -> str:
@@ -439,57 +449,94 @@ class FileProcessor:
         )
 
     async def process_file(self, file_path: str, filename: str) -> Tuple[str, str]:
-        """Process uploaded file and extract content summary"""
+        """Process uploaded file and extract content summary.
+
+        Parsing is blocking and CPU heavy, so it runs in the extraction process
+        pool rather than on the event loop.
+        """
         try:
-            # Get candidates from both detectors
-            mt_guess, _ = mimetypes.guess_type(filename)
-            mg_guess = None
-            if HAS_MAGIC:
-                try:
-                    mg_guess = magic.from_file(file_path, mime=True)  # type: ignore
-                except Exception as e:
-                    logger.warning(f"[magic] failed to detect file type: {e}")
+            return await extraction_pool.run(_process_file_job, file_path, filename)
+        except ExtractionTimeout as e:
+            logger.error(f"Timed out processing file {filename}: {e}")
+            return (f"Error processing file: {str(e)}", "error")
+        except Exception as e:
+            logger.exception(f"Error processing file {filename}: {e}")
+            return (f"Error processing file: {str(e)}", "error")
 
-            # Start with extension map (never 'zip' for OOXML)
-            file_type = guess_type_by_extension(filename)
+    async def process_upload(self, file_path: str, filename: str, sha256: str) -> Tuple[str, str]:
+        """Process an upload, reusing the cached extraction of identical content"""
+        extension = os.path.splitext(filename)[1]
+        cached = await extraction_cache.get(sha256, extension, filename)
+        if cached is not None:
+            logger.info(f"Reusing cached extraction for {filename} ({sha256[:12]})")
+            return cached
+
+        processed_content, file_type = await self.process_file(file_path, filename)
+        await extraction_cache.put(sha256, extension, filename, processed_content, file_type)
+        return processed_content, file_type
+
+    def detect_file_type(self, file_path: str, filename: str) -> str:
+        """Work out the MIME type from the extension, python-magic and mimetypes"""
+        # Get candidates from both detectors
+        mt_guess, _ = mimetypes.guess_type(filename)
+        mg_guess = None
+        if HAS_MAGIC:
+            try:
+                mg_guess = magic.from_file(file_path, mime=True)  # type: ignore
+            except Exception as e:
+                logger.warning(f"[magic] failed to detect file type: {e}")
 
-            # If magic confidently says image/* or pdf/text, prefer it
-            if mg_guess and (mg_guess.startswith("image/") or mg_guess in ("application/pdf",) or mg_guess.startswith("text/")):
-                file_type = mg_guess
+        # Start with extension map (never 'zip' for OOXML)
+        file_type = guess_type_by_extension(filename)
 
-            # If still generic from extension, let mimetypes refine
-            if file_type == "application/octet-stream" and mt_guess:
-                file_type = mt_guess
+        # If magic confidently says image/* or pdf/text, prefer it
+        if mg_guess and (mg_guess.startswith("image/") or mg_guess in ("application/pdf",) or mg_guess.startswith("text/")):
+            file_type = mg_guess
 
-            # Finally, normalize office doc zip/legacy types by extension
-            file_type = normalize_office_mime(filename, file_type)
+        # If still generic from extension, let mimetypes refine
+        if file_type == "application/octet-stream" and mt_guess:
+            file_type = mt_guess
 
-            logger.info(f"[MIME] filename={filename} ext_guess={guess_type_by_extension(filename)} mt_guess={mt_guess} magic={mg_guess} -> final={file_type}")
+        # Finally, normalize office doc zip/legacy types by extension
+        file_type = normalize_office_mime(filename, file_type)
+
+        logger.info(f"[MIME] filename={filename} ext_guess={guess_type_by_extension(filename)} mt_guess={mt_guess} magic={mg_guess} -> final={file_type}")
+        return file_type
+
+    def process_file_sync(self, file_path: str, filename: str) -> Tuple[str, str]:
+        """Detect the file type and run the matching handler (blocking)"""
+        try:
+            file_type = self.detect_file_type(file_path, filename)
 
             # ---- Dispatch by final file_type ----
             if file_type.startswith("image/"):
-                return await self._process_image(file_path, filename)
+                return self._process_image(file_path, filename)
             elif file_type == "application/pdf":
-                return await self._process_pdf(file_path, filename)
+                return self._process_pdf(file_path, filename)
             elif file_type in (
                 "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
                 "application/msword",
             ):
-                return await self._process_word(file_path, filename)
+                return self._process_word(file_path, filename)
+            elif file_type in ("text/csv", "application/csv") or (
+                # magic reports CSVs as plain text
+                file_type == "text/plain" and filename.lower().endswith(".csv")
+            ):
+                return self._process_csv(file_path, filename)
             elif file_type == "text/plain":
-                return await self._process_text(file_path, filename)
+                return self._process_text(file_path, filename)
             elif file_type in (
                 "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                 "application/vnd.ms-excel",
             ):
-                return await self._process_excel(file_path, filename)
+                return self._process_excel(file_path, filename)
             elif file_type in (
                 "application/vnd.openxmlformats-officedocument.presentationml.presentation",
                 "application/vnd.ms-powerpoint",
             ):
-                return await self._process_ppt(file_path, filename)
+                return self._process_ppt(file_path, filename)
             elif file_type == "application/octet-stream":
-                return await self._process_unknown(file_path, filename, file_type)
+                return self._process_unknown(file_path, filename, file_type)
             else:
                 return (f"Unsupported file type: {file_type}", "error")
 
@@ -497,15 +544,84 @@ class FileProcessor:
             logger.exception(f"Error processing file {filename}: {e}")
             return (f"Error processing file: {str(e)}", "error")
 
+    def extract_chunks_sync(self, file_path: str, filename: str) -> List[str]:
+        """Full text of a document split into retrieval chunks (blocking).
+
+        Returns an empty list for types without meaningful running text.
+        """
+        file_type = self.detect_file_type(file_path, filename)
+        if file_type == "application/pdf":
+            full_text = self._read_pdf_text(file_path)
+        elif file_type in (
+            "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+            "application/msword",
+        ):
+            full_text = self._read_word_text(file_path, filename)
+        elif file_type == "text/plain":
+            full_text = self._read_text_file(file_path)
+        else:
+            return []
+        return self.text_splitter.split_text(full_text) if full_text else []
+
+    # ---------------- Text readers ----------------
+
+    def _open_pdf(self, file_path: str) -> PdfReader:
+        reader = PdfReader(file_path)
+        if reader.is_encrypted:
+            reader.decrypt("")  # many "encrypted" PDFs only restrict editing
+        return reader
+
+    def _iter_pdf_pages(self, reader: PdfReader) -> Iterator[str]:
+        """Text of each page, extracted only when the caller asks for it"""
+        for page in reader.pages:
+            yield page.extract_text() or ""
+
+    def _read_pdf_text(self, file_path: str) -> str:
+        reader = self._open_pdf(file_path)
+        return "\n\n".join(text for text in self._iter_pdf_pages(reader) if text.strip())
+
+    def _read_word_text(self, file_path: str, filename: str) -> str:
+        # Prefer python-docx first (no heavy deps, very reliable for .docx)
+        try:
+            doc = DocxDocument(file_path)
+            paras = [p.text.strip() for p in doc.paragraphs if p.text and p.text.strip()]
+            full_text = "\n".join(paras)
+
+            if not full_text:
+                # try tables if body text is empty
+                table_lines = []
+                for tbl in doc.tables:
+                    for row in tbl.rows:
+                        cells = [c.text.strip() for c in row.cells if c.text and c.text.strip()]
+                        if cells:
+                            table_lines.append(" | ".join(cells))
+                full_text = "\n".join(table_lines)
+
+            if full_text:
+                return full_text
+        except Exception as e:
+            logger.warning(f"[python-docx] failed on {filename}: {e}")
+
+        # Fallback to Unstructured loader if python-docx failed
+        documents = UnstructuredWordDocumentLoader(file_path).load()
+        return "\n\n".join(doc.page_content for doc in documents)
+
+    def _read_text_file(self, file_path: str) -> str:
+        try:
+            loader = TextLoader(file_path, encoding="utf-8", autodetect_encoding=True, errors="ignore")
+        except TypeError:
+            loader = TextLoader(file_path, encoding="utf-8")
+        documents = loader.load()
+        return documents[0].page_content if documents else ""
+
     # ---------------- Handlers ----------------
 
-    async def _process_image(self, file_path: str, filename: str) -> Tuple[str, str]:
+    def _process_image(self, file_path: str, filename: str) -> Tuple[str, str]:
         try:
             with Image.open(file_path) as img:
+                width, height = img.size
+                format_name = img.format
                 img.verify()
-            with Image.open(file_path) as img2:
-                width, height = img2.size
-                format_name = img2.format
 
             content = (
                 f"Image uploaded: {filename}\n"
@@ -519,19 +635,40 @@ class FileProcessor:
         except Exception as e:
             return f"Error processing image: {str(e)}", "error"
 
-    async def _process_pdf(self, file_path: str, filename: str) -> Tuple[str, str]:
+    def _process_pdf(self, file_path: str, filename: str) -> Tuple[str, str]:
+        """Preview a PDF from its first pages only.
+
+        The page count comes from the page tree, and extraction stops once the
+        preview is full, so large PDFs cost about as much as small ones. The
+        full text is read separately by the document index, if enabled.
+        """
         try:
-            loader = PyPDFLoader(file_path)
-            documents = loader.load()
-            if not documents:
+            reader = self._open_pdf(file_path)
+            page_count = len(reader.pages)
+            if not page_count:
                 return "PDF appears to be empty or unreadable.", "error"
 
-            full_text = "\n\n".join(doc.page_content for doc in documents)
-            preview = full_text[:2000] + ("..." if len(full_text) > 2000 else "")
+            parts = []
+            length = 0
+            pages_read = 0
+            for text in self._iter_pdf_pages(reader):
+                pages_read += 1
+                if text.strip():
+                    parts.append(text)
+                    length += len(text)
+                if length > PREVIEW_CHARS:
+                    break
+
+            text = "\n\n".join(parts)
+            preview = text[:PREVIEW_CHARS] + ("..." if len(text) > PREVIEW_CHARS or pages_read < page_count else "")
+            if pages_read < page_count:
+                extent = f"Preview taken from the first {pages_read} of {page_count} pages\n\n"
+            else:
+                extent = f"Content length: {len(text)} characters\n\n"
             content = (
                 f"PDF Document: {filename}\n"
-                f"Pages: {len(documents)}\n"
-                f"Content length: {len(full_text)} characters\n\n"
+                f"Pages: {page_count}\n"
+                + extent +
                 "Document preview:\n" + preview + "\n\n"
                 "Document loaded successfully. You can ask me questions about its content."
             )
@@ -539,43 +676,12 @@ class FileProcessor:
         except Exception as e:
             return f"Error processing PDF: {str(e)}", "error"
 
-    async def _process_word(self, file_path: str, filename: str) -> Tuple[str, str]:
-        # Prefer python-docx first (no heavy deps, very reliable for .docx)
+    def _process_word(self, file_path: str, filename: str) -> Tuple[str, str]:
         try:
-            doc = DocxDocument(file_path)
-            paras = [p.text.strip() for p in doc.paragraphs if p.text and p.text.strip()]
-            full_text = "\n".join(paras)
-
+            full_text = self._read_word_text(file_path, filename)
             if not full_text:
-                # try tables if body text is empty
-                table_lines = []
-                for tbl in doc.tables:
-                    for row in tbl.rows:
-                        cells = [c.text.strip() for c in row.cells if c.text and c.text.strip()]
-                        if cells:
-                            table_lines.append(" | ".join(cells))
-                full_text = "\n".join(table_lines)
-
-            if full_text:
-                preview = full_text[:2000] + ("..." if len(full_text) > 2000 else "")
-                content = (
-                    f"Word Document: {filename}\n"
-                    f"Content length: {len(full_text)} characters\n\n"
-                    "Document preview:\n" + preview + "\n\n"
-                    "Document loaded successfully. You can ask me questions about its content."
-                )
-                return content, "word"
-        except Exception as e:
-            logger.warning(f"[python-docx] failed on {filename}: {e}")
-
-        # Fallback to Unstructured loader if python-docx failed
-        try:
-            loader = UnstructuredWordDocumentLoader(file_path)
-            documents = loader.load()
-            if not documents:
                 return "Word document appears to be empty or unreadable.", "error"
 
-            full_text = "\n\n".join(doc.page_content for doc in documents)
             preview = full_text[:2000] + ("..." if len(full_text) > 2000 else "")
             content = (
                 f"Word Document: {filename}\n"
@@ -587,17 +693,12 @@ class FileProcessor:
         except Exception as e:
             return f"Error processing Word document: {str(e)}", "error"
 
-    async def _process_text(self, file_path: str, filename: str) -> Tuple[str, str]:
+    def _process_text(self, file_path: str, filename: str) -> Tuple[str, str]:
         try:
-            try:
-                loader = TextLoader(file_path, encoding="utf-8", autodetect_encoding=True, errors="ignore")
-            except TypeError:
-                loader = TextLoader(file_path, encoding="utf-8")
-            documents = loader.load()
-            if not documents:
+            full_text = self._read_text_file(file_path)
+            if not full_text:
                 return "Text file appears to be empty.", "error"
 
-            full_text = documents[0].page_content
             preview = full_text[:2000] + ("..." if len(full_text) > 2000 else "")
             content = (
                 f"Text File: {filename}\n"
@@ -609,47 +710,84 @@ class FileProcessor:
         except Exception as e:
             return f"Error processing text file: {str(e)}", "error"
 
-    async def _process_csv(self, file_path: str, filename: str) -> Tuple[str, str]:
+    def _process_csv(self, file_path: str, filename: str) -> Tuple[str, str]:
+        """Stream a CSV of any size through the column profiler in chunks"""
         try:
-            df = pd.read_csv(file_path, nrows=5, encoding="utf-8", on_bad_lines="skip")
-            preview = df.to_string(index=False)
+            encoding, delimiter = self._sniff_csv(file_path)
+
+            profiler = ColumnProfiler()
+            preview = None
+            reader = pd.read_csv(
+                file_path,
+                sep=delimiter,
+                encoding=encoding,
+                encoding_errors="replace",
+                on_bad_lines="skip",
+                chunksize=settings.csv_chunk_rows,
+            )
+            with reader:
+                for chunk in reader:
+                    if preview is None:
+                        preview = chunk.head(5)
+                    profiler.update(chunk)
+
+            column_count = len(profiler.columns) if preview is None else preview.shape[1]
             content = (
                 f"CSV File: {filename}\n"
-                f"Preview (first 5 rows):\n{preview}\n\n"
+                f"Encoding: {encoding}, delimiter: {delimiter!r}\n\n"
+                + self._describe_table("Table", profiler.rows, column_count, preview, profiler) + "\n\n"
                 "CSV file loaded successfully. You can ask me about its contents."
             )
             return content, "csv"
-        except UnicodeDecodeError:
-            try:
-                df = pd.read_csv(file_path, nrows=5, encoding="latin-1", on_bad_lines="skip")
-                preview = df.to_string(index=False)
-                content = (
-                    f"CSV File: {filename}\n"
-                    f"(latin-1 fallback)\n"
-                    f"Preview (first 5 rows):\n{preview}\n\n"
-                    "CSV file loaded successfully. You can ask me about its contents."
-                )
-                return content, "csv"
-            except Exception as e:
-                return f"Error processing CSV file (encoding): {str(e)}", "error"
+        except pd.errors.EmptyDataError:
+            return "CSV file appears to be empty.", "error"
         except Exception as e:
             return f"Error processing CSV file: {str(e)}", "error"
 
-    async def _process_excel(self, file_path: str, filename: str) -> Tuple[str, str]:
+    def _sniff_csv(self, file_path: str, sample_size: int = 1024 * 1024) -> Tuple[str, str]:
+        """Detect encoding and delimiter once, from the head of the file"""
+        with open(file_path, "rb") as f:
+            sample = f.read(sample_size)
+
         try:
-            engine = None
-            try:
-                import openpyxl  # noqa: F401
-                engine = "openpyxl"
-            except Exception:
-                pass
+            # Most exports are UTF-8; a strict decode confirms that cheaply and
+            # final=False tolerates a character cut off at the end of the sample
+            codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+            encoding = "utf-8"
+        except UnicodeDecodeError:
+            matches = from_bytes(sample)
+            best = matches.best()
+            encoding = best.encoding if best is not None else "latin-1"
+            # Single-byte code pages often tie on short samples; prefer the Western one
+            for match in matches:
+                if (match.chaos, match.coherence) == (best.chaos, best.coherence) and \
+                        "cp1252" in (match.encoding, *match.could_be_from_charset):
+                    encoding = "cp1252"
+                    break
+
+        text = sample.decode(encoding, errors="replace")
+        if len(sample) == sample_size:
+            text = text[:text.rfind("\n") + 1] or text  # drop the partial last line
+        try:
+            delimiter = csv.Sniffer().sniff(text[:64 * 1024], delimiters=",;\t|").delimiter
+        except csv.Error:
+            delimiter = ","
+        return encoding, delimiter
+
+    def _process_excel(self, file_path: str, filename: str) -> Tuple[str, str]:
+        """Preview and profile every sheet of a workbook in bounded memory"""
+        try:
+            if os.path.splitext(filename)[1].lower() == ".xls":
+                sheets = self._describe_xls(file_path)
+            else:
+                sheets = self._describe_xlsx(file_path)
+            if not sheets:
+                return "Excel file contains no sheets.", "error"
 
-            df = pd.read_excel(file_path, engine=engine)
-            preview = df.head(5).to_string(index=False)
             content = (
                 f"Excel File: {filename}\n"
-                f"Rows: {df.shape[0]}, Columns: {df.shape[1]}\n\n"
-                f"Preview:\n{preview}\n\n"
+                f"Sheets: {len(sheets)}\n\n"
+                + "\n\n".join(sheets) + "\n\n"
                 "Excel file loaded successfully. You can ask me about its contents."
             )
             return content, "excel"
@@ -658,7 +796,91 @@ class FileProcessor:
         except Exception as e:
             return f"Error processing Excel file: {str(e)}", "error"
 
-    async def _process_ppt(self, file_path: str, filename: str) -> Tuple[str, str]:
+    def _describe_xlsx(self, file_path: str) -> List[str]:
+        import openpyxl
+
+        # read_only streams rows from the XML instead of building every cell object
+        workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            return [self._describe_sheet(sheet) for sheet in workbook.worksheets]
+        finally:
+            workbook.close()
+
+    def _describe_sheet(self, sheet) -> str:
+        """Stream one read-only worksheet through the profiler, chunk by chunk"""
+        # Taken from the stored sheet dimension, no cells are read for it
+        dimension_rows = sheet.max_row
+        max_rows = settings.spreadsheet_profile_max_rows
+        chunk_rows = settings.tabular_chunk_rows
+
+        rows = sheet.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return f'Sheet "{sheet.title}": empty'
+        columns = unique_headers(header)
+        width = len(columns)
+
+        profiler = ColumnProfiler()
+        preview = None
+        batch = []
+        truncated = False
+
+        def flush():
+            nonlocal preview
+            chunk = pd.DataFrame(batch, columns=columns).infer_objects()
+            if preview is None:
+                preview = chunk.head(5)
+            profiler.update(chunk)
+            batch.clear()
+
+        for row in rows:
+            if all(value is None for value in row):
+                continue  # formatted but empty rows
+            if profiler.rows + len(batch) >= max_rows:
+                truncated = True
+                break
+            batch.append(tuple(row[:width]) + (None,) * (width - len(row)))
+            if len(batch) >= chunk_rows:
+                flush()
+        if batch:
+            flush()
+
+        row_count = profiler.rows
+        if truncated:
+            # Sheets written without a dimension record report no size
+            row_count = dimension_rows - 1 if dimension_rows else f"more than {profiler.rows}"
+        return self._describe_table(f'Sheet "{sheet.title}"', row_count, width, preview, profiler, truncated)
+
+    def _describe_xls(self, file_path: str) -> List[str]:
+        """Legacy .xls is not supported by openpyxl; read it whole with pandas (xlrd)"""
+        max_rows = settings.spreadsheet_profile_max_rows
+        sheets = pd.read_excel(file_path, sheet_name=None, nrows=max_rows)
+        descriptions = []
+        for title, df in sheets.items():
+            profiler = ColumnProfiler()
+            for start in range(0, len(df), settings.tabular_chunk_rows):
+                profiler.update(df.iloc[start:start + settings.tabular_chunk_rows])
+            descriptions.append(self._describe_table(
+                f'Sheet "{title}"', len(df), df.shape[1], df.head(5), profiler, len(df) >= max_rows
+            ))
+        return descriptions
+
+    def _describe_table(self, label: str, row_count: "int | str", column_count: int,
+                        preview: "pd.DataFrame | None", profiler: ColumnProfiler,
+                        truncated: bool = False) -> str:
+        lines = [f"{label}: {row_count} rows x {column_count} columns"]
+        if truncated:
+            lines[0] += f" (statistics from the first {profiler.rows} rows)"
+        if preview is None or preview.empty:
+            lines.append("No data rows.")
+            return "\n".join(lines)
+        lines.append("Preview (first 5 rows):")
+        lines.append(preview.to_string(index=False, max_cols=20))
+        lines.append("Column profile:")
+        lines.append(profiler.describe())
+        return "\n".join(lines)
+
+    def _process_ppt(self, file_path: str, filename: str) -> Tuple[str, str]:
         try:
             prs = Presentation(file_path)  # note: supports .pptx, not legacy .ppt
             text_lines = []
@@ -684,7 +906,7 @@ class FileProcessor:
                 return ("This looks like a legacy .ppt file. Please convert to .pptx and re-upload.", "error")
             return f"Error processing PowerPoint file: {str(e)}", "error"
 
-    async def _process_unknown(self, file_path: str, filename: str, file_type: str) -> Tuple[str, str]:
+    def _process_unknown(self, file_path: str, filename: str, file_type: str) -> Tuple[str, str]:
         try:
             size_kb = round(os.path.getsize(file_path) / 1024, 2)
             content = (
@@ -700,3 +922,13 @@ class FileProcessor:
 
 # Export instance
 file_processor = FileProcessor()
+
+
+def _process_file_job(file_path: str, filename: str) -> Tuple[str, str]:
+    """Entry point for extraction pool workers"""
+    return file_processor.process_file_sync(file_path, filename)
+
+
+def _extract_chunks_job(file_path: str, filename: str) -> List[str]:
+    """Entry point for extraction pool workers building the document index"""
+    return file_processor.extract_chunks_sync(file_path, filename)
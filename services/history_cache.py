@@ -0,0 +1,168 @@
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import List, Optional
+from config import settings
+from models import Chat, Message
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class _CacheEntry:
+    __slots__ = ("chat", "messages", "since", "expires_at")
+
+    def __init__(self):
+        self.chat: Optional[Chat] = None
+        # messages holds every message of the chat newer than `since` (None = all of them)
+        self.messages: Optional[List[Message]] = None
+        self.since: Optional[datetime] = None
+        self.expires_at = 0.0
+
+
+class HistoryCache:
+    """In-process LRU + TTL cache of chat documents and their recent messages.
+
+    ChatService writes through to it on every change, so consecutive turns in
+    the same chat are served without re-reading Mongo. Another worker may have
+    written to the chat since, so callers check an entry with ``is_current``
+    against the chat's stored ``message_count``, ``updated_at`` and
+    ``summarized_until`` before using it. Entries also expire after ``ttl_seconds``.
+    """
+
+    def __init__(self, max_chats: int = 1000, ttl_seconds: float = 300,
+                 max_messages: int = 200):
+        self.max_chats = max_chats
+        self.ttl_seconds = ttl_seconds
+        self.max_messages = max_messages
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self.chat_hits = 0
+        self.chat_misses = 0
+        self.message_hits = 0
+        self.message_misses = 0
+        self.evictions = 0
+        self.stale = 0
+
+    def _get_entry(self, chat_id: str) -> Optional[_CacheEntry]:
+        entry = self._entries.get(chat_id)
+        if entry is None:
+            return None
+        if entry.expires_at < time.monotonic():
+            del self._entries[chat_id]
+            return None
+        self._entries.move_to_end(chat_id)
+        return entry
+
+    def _touch_entry(self, chat_id: str) -> _CacheEntry:
+        entry = self._get_entry(chat_id)
+        if entry is None:
+            entry = _CacheEntry()
+            self._entries[chat_id] = entry
+            while len(self._entries) > self.max_chats:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        entry.expires_at = time.monotonic() + self.ttl_seconds
+        return entry
+
+    def _trim(self, entry: _CacheEntry):
+        overflow = len(entry.messages) - self.max_messages
+        if overflow > 0:
+            entry.since = entry.messages[overflow - 1].timestamp
+            del entry.messages[:overflow]
+
+    def is_current(self, chat_id: str, message_count: int, updated_at: datetime,
+                   summarized_until: Optional[datetime]) -> bool:
+        """Whether the cached chat still matches the stored one; drops it if not"""
+        entry = self._entries.get(chat_id)
+        if entry is None or entry.chat is None:
+            return False
+        chat = entry.chat
+        if (chat.message_count == message_count and chat.updated_at == updated_at
+                and chat.summarized_until == summarized_until):
+            return True
+        # Written by another worker since it was cached
+        del self._entries[chat_id]
+        self.stale += 1
+        return False
+
+    # ---------- chats ----------
+
+    def get_chat(self, chat_id: str) -> Optional[Chat]:
+        entry = self._get_entry(chat_id)
+        if entry is None or entry.chat is None:
+            self.chat_misses += 1
+            return None
+        self.chat_hits += 1
+        return entry.chat
+
+    def put_chat(self, chat: Chat):
+        self._touch_entry(chat.id).chat = chat
+
+    def update_chat(self, chat_id: str, **fields):
+        """Apply a partial update to the cached chat, if it is cached"""
+        entry = self._get_entry(chat_id)
+        if entry is not None and entry.chat is not None:
+            entry.chat = entry.chat.model_copy(update=fields)
+
+    # ---------- messages ----------
+
+    def get_messages(self, chat_id: str, since: Optional[datetime] = None) -> Optional[List[Message]]:
+        """Return the chat's messages newer than since, or None if they are not all cached"""
+        entry = self._get_entry(chat_id)
+        covered = entry is not None and entry.messages is not None and (
+            entry.since is None or (since is not None and since >= entry.since)
+        )
+        if not covered:
+            self.message_misses += 1
+            return None
+        self.message_hits += 1
+        if since is None:
+            return list(entry.messages)
+        return [m for m in entry.messages if m.timestamp > since]
+
+    def put_messages(self, chat_id: str, messages: List[Message], since: Optional[datetime] = None):
+        entry = self._touch_entry(chat_id)
+        entry.messages = list(messages)
+        entry.since = since
+        self._trim(entry)
+
+    def append_message(self, chat_id: str, message: Message):
+        """Write a newly stored message through to the cache"""
+        entry = self._get_entry(chat_id)
+        if entry is None:
+            return
+        entry.expires_at = time.monotonic() + self.ttl_seconds
+        if entry.messages is not None:
+            entry.messages.append(message)
+            self._trim(entry)
+        if entry.chat is not None:
+            entry.chat = entry.chat.model_copy(update={
+                "updated_at": message.timestamp,
+                "message_count": entry.chat.message_count + 1,
+            })
+
+    def invalidate(self, chat_id: str):
+        self._entries.pop(chat_id, None)
+
+    def stats(self) -> dict:
+        chat_lookups = self.chat_hits + self.chat_misses
+        message_lookups = self.message_hits + self.message_misses
+        return {
+            "size": len(self._entries),
+            "max_chats": self.max_chats,
+            "chat_hits": self.chat_hits,
+            "chat_misses": self.chat_misses,
+            "chat_hit_rate": round(self.chat_hits / chat_lookups, 4) if chat_lookups else 0.0,
+            "message_hits": self.message_hits,
+            "message_misses": self.message_misses,
+            "message_hit_rate": round(self.message_hits / message_lookups, 4) if message_lookups else 0.0,
+            "evictions": self.evictions,
+            "stale": self.stale,
+        }
+
+
+history_cache = HistoryCache(
+    max_chats=settings.history_cache_max_chats,
+    ttl_seconds=settings.history_cache_ttl_seconds,
+    max_messages=settings.history_cache_max_messages,
+)
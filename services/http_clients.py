@@ -0,0 +1,149 @@
+import importlib.util
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, Optional
+import httpcore
+import httpx
+from config import settings
+from services.public_network import PublicAddressBackend
+import logging
+
+logger = logging.getLogger(__name__)
+
+# HTTP/2 needs the optional h2 package (pip install "httpx[http2]")
+HAS_H2 = importlib.util.find_spec("h2") is not None
+
+
+@dataclass
+class Upstream:
+    name: str
+    base_url: str = ""
+    timeout: float = 10.0
+    connect_timeout: float = 5.0
+    max_connections: int = 20
+    max_keepalive_connections: int = 10
+    follow_redirects: bool = False
+    headers: Optional[Dict[str, str]] = None
+    network_backend: Optional[httpcore.AsyncNetworkBackend] = None  # how connections are opened
+
+
+class HTTPClients:
+    """One long-lived httpx.AsyncClient per upstream service.
+
+    Reusing a client keeps connections alive between requests, so calls to
+    the same host skip the TCP and TLS handshakes. Each upstream gets its own
+    pool limits and timeouts. Clients are created in the app lifespan (or
+    lazily on first use) and closed on shutdown.
+    """
+
+    def __init__(self, http2: bool = True, keepalive_expiry: float = 30.0):
+        self.http2 = http2 and HAS_H2
+        self.keepalive_expiry = keepalive_expiry
+        self._upstreams: Dict[str, Upstream] = {}
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._requests: Counter = Counter()
+        self._responses: Dict[str, Counter] = {}
+
+        if http2 and not HAS_H2:
+            logger.info("h2 is not installed, outbound HTTP clients use HTTP/1.1")
+
+    def register(self, upstream: Upstream):
+        self._upstreams[upstream.name] = upstream
+
+    def _create(self, upstream: Upstream) -> httpx.AsyncClient:
+        name = upstream.name
+
+        async def on_request(request: httpx.Request):
+            self._requests[name] += 1
+
+        async def on_response(response: httpx.Response):
+            self._responses.setdefault(name, Counter())[f"{response.status_code // 100}xx"] += 1
+
+        limits = httpx.Limits(
+            max_connections=upstream.max_connections,
+            max_keepalive_connections=upstream.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+        transport = None
+        if upstream.network_backend is not None:
+            transport = httpx.AsyncHTTPTransport(http2=self.http2, limits=limits)
+            # httpx does not expose httpcore's network_backend option; not public API
+            transport._pool._network_backend = upstream.network_backend
+
+        return httpx.AsyncClient(
+            base_url=upstream.base_url,
+            http2=self.http2,
+            timeout=httpx.Timeout(upstream.timeout, connect=upstream.connect_timeout),
+            limits=limits,
+            transport=transport,
+            # An environment proxy would open the connections instead of the backend
+            trust_env=upstream.network_backend is None,
+            follow_redirects=upstream.follow_redirects,
+            headers=upstream.headers,
+            event_hooks={"request": [on_request], "response": [on_response]},
+        )
+
+    def start(self):
+        for name, upstream in self._upstreams.items():
+            if name not in self._clients:
+                self._clients[name] = self._create(upstream)
+
+    async def shutdown(self):
+        clients, self._clients = self._clients, {}
+        for client in clients.values():
+            await client.aclose()
+
+    def get(self, name: str) -> httpx.AsyncClient:
+        """The shared client for an upstream"""
+        client = self._clients.get(name)
+        if client is None:
+            client = self._clients[name] = self._create(self._upstreams[name])
+        return client
+
+    @staticmethod
+    def _pool_stats(client: httpx.AsyncClient) -> Optional[dict]:
+        # httpcore keeps its connections on the transport's pool; not public API
+        try:
+            connections = client._transport._pool.connections
+        except AttributeError:
+            return None
+        idle = sum(1 for connection in connections if connection.is_idle())
+        return {"connections": len(connections), "idle": idle, "active": len(connections) - idle}
+
+    def stats(self) -> dict:
+        upstreams = {}
+        for name, upstream in self._upstreams.items():
+            client = self._clients.get(name)
+            upstreams[name] = {
+                "requests": self._requests[name],
+                "responses": dict(self._responses.get(name, {})),
+                "max_connections": upstream.max_connections,
+                "pool": self._pool_stats(client) if client is not None else None,
+            }
+        return {"http2": self.http2, "upstreams": upstreams}
+
+
+http_clients = HTTPClients(http2=settings.http2_enabled, keepalive_expiry=settings.http_keepalive_expiry_seconds)
+http_clients.register(Upstream(
+    "google",
+    base_url="https://www.googleapis.com",
+    timeout=settings.google_timeout_seconds,
+    max_connections=settings.http_max_connections,
+    max_keepalive_connections=settings.http_max_keepalive_connections,
+))
+http_clients.register(Upstream(
+    "web",  # result pages read for web grounding; any host, so no base URL
+    timeout=settings.web_fetch_timeout_seconds,
+    max_connections=settings.http_max_connections,
+    max_keepalive_connections=settings.http_max_keepalive_connections,
+    follow_redirects=False,  # WebGrounding follows them itself, checking each hop's scheme
+    network_backend=PublicAddressBackend(),  # any host, so never connect to internal addresses
+    headers={"User-Agent": "Mozilla/5.0 (compatible; ChatbotGrounding/1.0)", "Accept": "text/html,application/xhtml+xml;q=0.9,text/plain;q=0.8"},
+))
+http_clients.register(Upstream(
+    "tts",
+    base_url=settings.azure_tts_openai_api_endpoint,
+    timeout=settings.tts_timeout_seconds,
+    max_connections=settings.http_max_connections,
+    max_keepalive_connections=settings.http_max_keepalive_connections,
+))
@@ -0,0 +1,317 @@
+import asyncio
+import dataclasses
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from pymongo import ReturnDocument
+from database import get_database
+from models import ChatResponse, IngestionJob, JobStatus
+from services.upload_storage import StoredUpload
+from services.upload_turns import process_upload_turn
+from config import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Stage of a job whose chat turn is stored but whose final status update is not
+COMMITTED_STAGE = "committed"
+
+
+class IngestionJobs:
+    """Uploads processed off the request path by a small in-process worker pool.
+
+    Jobs are stored in the ``ingestion_jobs`` collection before they are
+    queued, so they survive restarts. Workers claim a job with an atomic
+    update that takes a lease, and renew the lease while the job runs; every
+    ``recover_interval`` seconds (and on startup) queued jobs and jobs whose
+    lease ran out, e.g. because their process died, are picked up again. Several
+    app processes can share the collection. At most ``workers`` uploads are
+    processed at once per process.
+
+    Once a job's chat turn is stored it is marked ``committed``; such a job is
+    completed rather than run again, so its messages are never posted twice.
+    """
+
+    def __init__(self, workers: int = 2, lease_seconds: int = 900, max_attempts: int = 3,
+                 recover_interval: float = 60):
+        self.workers = workers
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.recover_interval = recover_interval
+        self.db = None
+        self._owner = uuid.uuid4().hex  # identifies this process's leases
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._queued = set()  # job ids waiting in this process's queue
+        self._running = set()  # job ids being processed by this process
+        self._committed = set()  # running job ids whose chat turn is already stored
+        self._updates: Dict[str, asyncio.Event] = {}
+        self._waiters: Counter = Counter()  # wait_for_update callers per job id
+
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.recovered = 0
+        self.lease_renewals = 0
+        self.leases_lost = 0
+
+    def get_db(self):
+        if self.db is None:
+            self.db = get_database()
+        return self.db
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue()
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"ingestion-worker-{i}")
+            for i in range(self.workers)
+        ]
+        await self._recover()
+        self._tasks.append(asyncio.create_task(self._recover_periodically(), name="ingestion-recovery"))
+
+    async def shutdown(self):
+        # Taken before cancelling: the workers forget their jobs as they stop
+        running, committed = set(self._running), set(self._committed)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queued.clear()
+        now = datetime.utcnow()
+        # Hand interrupted jobs back to the queue for the next start, except those
+        # whose chat turn is already stored: running them again would post it twice
+        interrupted = running - committed
+        if interrupted:
+            await self.get_db().ingestion_jobs.update_many(
+                {"_id": {"$in": list(interrupted)}, "status": JobStatus.PROCESSING.value,
+                 "stage": {"$ne": COMMITTED_STAGE}},
+                {"$set": {"status": JobStatus.QUEUED.value, "stage": "queued", "progress": 0,
+                          "lease_until": None, "updated_at": now}},
+            )
+        if committed:
+            await self.get_db().ingestion_jobs.update_many(
+                {"_id": {"$in": list(committed)}, "status": JobStatus.PROCESSING.value},
+                {"$set": {"status": JobStatus.COMPLETED.value, "stage": "done", "progress": 100,
+                          "lease_until": None, "updated_at": now}},
+            )
+
+    async def submit(self, chat_id: str, stored: StoredUpload,
+                     message: Optional[str] = None,
+                     original_content: Optional[str] = None,
+                     web_search_results: Optional[str] = None) -> IngestionJob:
+        """Record a job for a stored upload and queue it"""
+        now = datetime.utcnow()
+        job_doc = {
+            "_id": str(uuid.uuid4()),
+            "chat_id": chat_id,
+            "filename": stored.original_filename,
+            "status": JobStatus.QUEUED.value,
+            "stage": "queued",
+            "progress": 0,
+            "upload": dataclasses.asdict(stored),
+            "message": message,
+            "original_content": original_content,
+            "web_search_results": web_search_results,
+            "attempts": 0,
+            "owner": None,
+            "lease_until": None,
+            "error": None,
+            "result": None,
+            "created_at": now,
+            "updated_at": now,
+        }
+        await self.get_db().ingestion_jobs.insert_one(job_doc)
+        self.submitted += 1
+        if self._queue is None:
+            await self.start()
+        self._enqueue(job_doc["_id"])
+        return IngestionJob(**job_doc)
+
+    async def get(self, job_id: str) -> Optional[IngestionJob]:
+        job_doc = await self.get_db().ingestion_jobs.find_one({"_id": job_id})
+        return IngestionJob(**job_doc) if job_doc else None
+
+    async def wait_for_update(self, job_id: str, timeout: float):
+        """Return when this process updates the job, or after timeout.
+
+        Jobs run by another process are not signalled here; callers simply
+        re-read the job after the timeout.
+        """
+        event = self._updates.setdefault(job_id, asyncio.Event())
+        self._waiters[job_id] += 1
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            # The last waiter drops the event, so polling a job never leaves one behind
+            self._waiters[job_id] -= 1
+            if self._waiters[job_id] <= 0:
+                del self._waiters[job_id]
+                if self._updates.get(job_id) is event:
+                    del self._updates[job_id]
+
+    async def _update(self, job_id: str, **fields):
+        fields["updated_at"] = datetime.utcnow()
+        await self.get_db().ingestion_jobs.update_one({"_id": job_id}, {"$set": fields})
+        event = self._updates.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+    def _enqueue(self, job_id: str):
+        if job_id in self._queued or job_id in self._running:
+            return
+        self._queued.add(job_id)
+        self._queue.put_nowait(job_id)
+
+    async def _claim(self, job_id: str) -> Optional[dict]:
+        now = datetime.utcnow()
+        return await self.get_db().ingestion_jobs.find_one_and_update(
+            {
+                "_id": job_id,
+                "$or": [
+                    {"status": JobStatus.QUEUED.value},
+                    {"status": JobStatus.PROCESSING.value, "lease_until": {"$lt": now},
+                     "stage": {"$ne": COMMITTED_STAGE}},
+                ],
+            },
+            {
+                "$set": {
+                    "status": JobStatus.PROCESSING.value,
+                    "owner": self._owner,
+                    "lease_until": now + timedelta(seconds=self.lease_seconds),
+                    "updated_at": now,
+                },
+                "$inc": {"attempts": 1},
+            },
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def _renew_lease(self, job_id: str):
+        """Keep extending the lease of a running job, so no other process takes it over"""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            result = await self.get_db().ingestion_jobs.update_one(
+                {"_id": job_id, "owner": self._owner, "status": JobStatus.PROCESSING.value},
+                {"$set": {"lease_until": datetime.utcnow() + timedelta(seconds=self.lease_seconds)}},
+            )
+            if not result.matched_count:
+                self.leases_lost += 1
+                logger.warning(f"Lost the lease on ingestion job {job_id}")
+                return
+            self.lease_renewals += 1
+
+    async def _recover(self):
+        now = datetime.utcnow()
+        db = self.get_db()
+        # The chat turn of these is stored; only the final status update was lost
+        await db.ingestion_jobs.update_many(
+            {"status": JobStatus.PROCESSING.value, "stage": COMMITTED_STAGE, "lease_until": {"$lt": now}},
+            {"$set": {"status": JobStatus.COMPLETED.value, "stage": "done", "progress": 100,
+                      "lease_until": None, "updated_at": now}},
+        )
+        cursor = db.ingestion_jobs.find(
+            {"$or": [
+                {"status": JobStatus.QUEUED.value},
+                {"status": JobStatus.PROCESSING.value, "lease_until": {"$lt": now}},
+            ]},
+            {"_id": 1},
+        ).sort("created_at", 1)
+        found = 0
+        async for job_doc in cursor:
+            if job_doc["_id"] in self._queued or job_doc["_id"] in self._running:
+                continue
+            found += 1
+            self._enqueue(job_doc["_id"])
+        self.recovered += found
+        if found:
+            logger.info(f"Re-queued {found} unfinished ingestion jobs")
+
+    async def _recover_periodically(self):
+        while True:
+            await asyncio.sleep(self.recover_interval)
+            try:
+                await self._recover()
+            except Exception as e:
+                logger.error(f"Ingestion job recovery failed: {e}")
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            self._queued.discard(job_id)
+            try:
+                self._running.add(job_id)
+                await self._run(job_id)
+            except Exception as e:
+                logger.exception(f"Ingestion worker error on job {job_id}: {e}")
+            finally:
+                self._running.discard(job_id)
+                self._committed.discard(job_id)
+                self._queue.task_done()
+
+    async def _run(self, job_id: str):
+        job_doc = await self._claim(job_id)
+        if job_doc is None:
+            return  # finished, or being run by another worker
+        if job_doc["attempts"] > self.max_attempts:
+            self.failed += 1
+            await self._update(job_id, status=JobStatus.FAILED.value, stage="failed",
+                               error=f"Gave up after {self.max_attempts} attempts", lease_until=None)
+            return
+
+        async def on_stage(stage: str, progress: int):
+            await self._update(job_id, stage=stage, progress=progress)
+
+        heartbeat = asyncio.create_task(self._renew_lease(job_id), name=f"ingestion-lease-{job_id}")
+        try:
+            try:
+                user_msg, ai_msg = await process_upload_turn(
+                    job_doc["chat_id"],
+                    StoredUpload(**job_doc["upload"]),
+                    message=job_doc["message"],
+                    original_content=job_doc["original_content"],
+                    web_search_results=job_doc["web_search_results"],
+                    index_inline=True,
+                    on_stage=on_stage,
+                )
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Ingestion job {job_id} failed: {e}")
+                await self._update(job_id, status=JobStatus.FAILED.value, stage="failed",
+                                   error=str(e), lease_until=None)
+                return
+
+            # The turn is stored: from here on the job must never run again
+            self._committed.add(job_id)
+            result = ChatResponse(chat_id=job_doc["chat_id"], message=user_msg, response=ai_msg)
+            await self._update(job_id, stage=COMMITTED_STAGE, progress=95, result=result.model_dump())
+            self.completed += 1
+            await self._update(job_id, status=JobStatus.COMPLETED.value, stage="done", progress=100,
+                               lease_until=None)
+        finally:
+            heartbeat.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "running": len(self._running),
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "recovered": self.recovered,
+            "lease_renewals": self.lease_renewals,
+            "leases_lost": self.leases_lost,
+            "waiting_clients": sum(self._waiters.values()),
+        }
+
+
+ingestion_jobs = IngestionJobs(
+    workers=settings.ingestion_workers,
+    lease_seconds=settings.ingestion_job_lease_seconds,
+    max_attempts=settings.ingestion_job_max_attempts,
+    recover_interval=settings.ingestion_job_recover_seconds,
+)
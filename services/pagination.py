@@ -0,0 +1,30 @@
+import base64
+from datetime import datetime
+from typing import Tuple
+
+
+def encode_cursor(timestamp: datetime, doc_id) -> str:
+    """Opaque keyset cursor for the (timestamp, _id) position of a document"""
+    raw = f"{timestamp.isoformat()}|{doc_id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """Inverse of encode_cursor; raises ValueError for malformed cursors"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8")
+        timestamp, doc_id = raw.split("|", 1)
+        return datetime.fromisoformat(timestamp), doc_id
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def before_filter(field: str, timestamp: datetime, doc_id) -> dict:
+    """Mongo filter for documents strictly after the cursor in (field, _id) descending order"""
+    return {
+        "$or": [
+            {field: {"$lt": timestamp}},
+            {field: timestamp, "_id": {"$lt": doc_id}},
+        ]
+    }
@@ -0,0 +1,63 @@
+import asyncio
+import ipaddress
+import socket
+from typing import Iterable, Optional
+import httpcore
+
+
+class BlockedURL(Exception):
+    """A URL the server must not fetch: not http(s), or resolving to a non-public address"""
+
+
+async def resolve_public_address(host: str, port: int) -> str:
+    """An address of host to connect to; raises BlockedURL unless all its addresses are public.
+
+    Web pages and their redirects come from outside, so without this a page
+    could point the server at localhost, the cloud metadata endpoint or the
+    internal network and have the response read back into the prompt.
+    """
+    try:
+        addresses = [ipaddress.ip_address(host)]
+    except ValueError:
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        except socket.gaierror as e:
+            raise BlockedURL(f"Cannot resolve {host}: {e}") from e
+        addresses = [ipaddress.ip_address(info[4][0]) for info in infos]
+    if not addresses:
+        raise BlockedURL(f"Cannot resolve {host}")
+    for address in addresses:
+        if isinstance(address, ipaddress.IPv6Address) and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        # is_global excludes private, loopback, link-local, reserved and shared ranges
+        if not address.is_global or address.is_multicast:
+            raise BlockedURL(f"{host} resolves to non-public address {address}")
+    return str(addresses[0])
+
+
+class PublicAddressBackend(httpcore.AsyncNetworkBackend):
+    """Network backend that only opens TCP connections to public addresses.
+
+    The host is resolved and checked when the connection is made, and the
+    socket goes to the checked address, so a second lookup cannot swap in an
+    internal one. URLs keep their host name: connections are pooled per
+    host, and TLS sends that name and verifies the certificate against it.
+    """
+
+    def __init__(self):
+        self._backend = httpcore.AnyIOBackend()
+
+    async def connect_tcp(self, host: str, port: int, timeout: Optional[float] = None,
+                          local_address: Optional[str] = None,
+                          socket_options: Optional[Iterable] = None) -> httpcore.AsyncNetworkStream:
+        address = await asyncio.wait_for(resolve_public_address(host, port), timeout)
+        return await self._backend.connect_tcp(
+            address, port, timeout=timeout, local_address=local_address, socket_options=socket_options
+        )
+
+    async def connect_unix_socket(self, path: str, timeout: Optional[float] = None,
+                                  socket_options: Optional[Iterable] = None) -> httpcore.AsyncNetworkStream:
+        raise BlockedURL(f"Unix socket {path}")
+
+    async def sleep(self, seconds: float):
+        await self._backend.sleep(seconds)
@@ -0,0 +1,160 @@
+import asyncio
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+import httpx
+from config import settings
+from services.http_clients import http_clients
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(query: str) -> str:
+    """Case-fold and collapse whitespace so equivalent queries share a cache entry"""
+    query = unicodedata.normalize("NFKC", query).casefold()
+    return re.sub(r"\s+", " ", query).strip()
+
+
+class _SearchEntry:
+    __slots__ = ("results", "fetched_at")
+
+    def __init__(self, results: List[dict], fetched_at: float):
+        self.results = results
+        self.fetched_at = fetched_at
+
+
+class SearchService:
+    """Google Custom Search with an in-process LRU + TTL result cache.
+
+    Results younger than ``ttl_seconds`` are served from the cache. For a
+    further ``stale_seconds`` they are still served immediately while one
+    background request refreshes them (stale-while-revalidate). Concurrent
+    misses for the same query share a single upstream call (single-flight).
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl_seconds: float = 300,
+                 stale_seconds: float = 900):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self._entries: "OrderedDict[Tuple[str, int], _SearchEntry]" = OrderedDict()
+        self._inflight: Dict[Tuple[str, int], asyncio.Task] = {}
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.refreshes = 0
+        self.upstream_calls = 0
+        self.upstream_errors = 0
+        self.evictions = 0
+        self._upstream_seconds = 0.0
+
+    async def search(self, query: str, num: int = 3) -> List[dict]:
+        """Search results as [{name, url, snippet}]; raises if the upstream call fails"""
+        key = (normalize_query(query), num)
+        entry = self._entries.get(key)
+        if entry is not None:
+            age = time.monotonic() - entry.fetched_at
+            if age < self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.results
+            if age < self.ttl_seconds + self.stale_seconds:
+                self._entries.move_to_end(key)
+                self.stale_hits += 1
+                if key not in self._inflight:
+                    self.refreshes += 1
+                    self._start_fetch(key, query)
+                return entry.results
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = self._start_fetch(key, query)
+        # shield: a caller that goes away must not cancel the fetch others wait on
+        return await asyncio.shield(task)
+
+    def _start_fetch(self, key: Tuple[str, int], query: str) -> asyncio.Task:
+        task = asyncio.create_task(self._fetch(key, query), name=f"search-{key[0][:30]}")
+        self._inflight[key] = task
+        task.add_done_callback(lambda t: self._on_fetch_done(key, t))
+        return task
+
+    def _on_fetch_done(self, key: Tuple[str, int], task: asyncio.Task):
+        self._inflight.pop(key, None)
+        if not task.cancelled() and task.exception() is not None:
+            # Retrieve the exception so a failed background refresh is not reported as
+            # unhandled; log no URL, it carries the API key
+            exc = task.exception()
+            reason = f"HTTP {exc.response.status_code}" if isinstance(exc, httpx.HTTPStatusError) else repr(exc)
+            logger.warning(f"Web search for {key[0]!r} failed: {reason}")
+
+    async def _fetch(self, key: Tuple[str, int], query: str) -> List[dict]:
+        started = time.perf_counter()
+        self.upstream_calls += 1
+        try:
+            response = await http_clients.get("google").get("/customsearch/v1", params={
+                "key": settings.google_api_key,
+                "cx": settings.google_search_engine_id,
+                "q": query,
+                "num": key[1],
+            })
+            response.raise_for_status()
+            items = response.json().get("items", [])
+        except Exception:
+            self.upstream_errors += 1
+            raise
+        finally:
+            self._upstream_seconds += time.perf_counter() - started
+
+        results = [
+            {
+                "name": item.get("title"),
+                "url": item.get("link"),
+                "snippet": item.get("snippet")
+            }
+            for item in items
+        ]
+        self._store(key, results)
+        return results
+
+    def _store(self, key: Tuple[str, int], results: List[dict]):
+        self._entries[key] = _SearchEntry(results, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.stale_hits + self.misses + self.coalesced
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0,
+            "refreshes": self.refreshes,
+            "upstream_calls": self.upstream_calls,
+            "upstream_errors": self.upstream_errors,
+            "avg_upstream_ms": round(self._upstream_seconds / self.upstream_calls * 1000, 1) if self.upstream_calls else 0.0,
+            "evictions": self.evictions,
+            "in_flight": len(self._inflight),
+        }
+
+
+search_service = SearchService(
+    max_entries=settings.search_cache_max_entries,
+    ttl_seconds=settings.search_cache_ttl_seconds,
+    stale_seconds=settings.search_cache_stale_seconds,
+)
@@ -0,0 +1,182 @@
+import re
+import time
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from config import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_question(text: str) -> str:
+    """Case-fold, drop punctuation and collapse whitespace so trivially different
+    phrasings of the same question share a cache key"""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = "".join(" " if unicodedata.category(ch).startswith("P") else ch for ch in text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+class SemanticCache:
+    """Nearest-neighbour cache of model answers keyed by question embeddings.
+
+    Vectors live in a fixed-capacity numpy matrix (one row per slot) and are
+    searched by cosine similarity. Exact matches on the normalized question are
+    answered without calling the embedder at all. Entries expire after
+    ``ttl_seconds``; when the cache is full the least recently used slot is
+    reused.
+
+    ``embedder`` is anything with an async ``aembed_query(text) -> List[float]``
+    method; it defaults to the shared Azure embeddings client.
+    """
+
+    def __init__(self, embedder=None, threshold: float = 0.95,
+                 ttl_seconds: float = 86400, max_entries: int = 5000):
+        self._embedder = embedder
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+
+        self._vectors: Optional[np.ndarray] = None  # allocated on first store
+        self._answers: List[Optional[str]] = [None] * max_entries
+        self._keys: List[Optional[str]] = [None] * max_entries
+        self._occupied = np.zeros(max_entries, dtype=bool)
+        self._expires_at = np.zeros(max_entries)
+        self._last_used = np.zeros(max_entries)
+        self._by_key: Dict[str, int] = {}
+
+        self.hits = 0
+        self.exact_hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.evictions = 0
+        self._lookup_seconds = 0.0
+        self._embed_seconds = 0.0
+        self._embed_calls = 0
+
+    @property
+    def embedder(self):
+        if self._embedder is None:
+            from services.embeddings import get_embeddings
+            self._embedder = get_embeddings()
+        return self._embedder
+
+    async def _embed(self, text: str) -> np.ndarray:
+        started = time.perf_counter()
+        vector = np.asarray(await self.embedder.aembed_query(text), dtype=np.float32)
+        self._embed_seconds += time.perf_counter() - started
+        self._embed_calls += 1
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _live_mask(self, now: float) -> np.ndarray:
+        return self._occupied & (self._expires_at > now)
+
+    def _is_live(self, slot: int, now: float) -> bool:
+        return bool(self._occupied[slot] and self._expires_at[slot] > now)
+
+    async def lookup(self, question: str) -> Tuple[Optional[str], Optional[np.ndarray]]:
+        """Return (cached answer or None, question embedding).
+
+        The embedding is handed back so a miss can be stored without embedding
+        the question a second time.
+        """
+        started = time.perf_counter()
+        key = normalize_question(question)
+        now = time.monotonic()
+        try:
+            slot = self._by_key.get(key)
+            if slot is not None and self._is_live(slot, now):
+                self._last_used[slot] = now
+                self.hits += 1
+                self.exact_hits += 1
+                return self._answers[slot], None
+
+            embedding = await self._embed(key)
+            if self._vectors is not None:
+                scores = self._vectors @ embedding
+                scores[~self._live_mask(now)] = -1.0
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    self._last_used[best] = now
+                    self.hits += 1
+                    return self._answers[best], embedding
+
+            self.misses += 1
+            return None, embedding
+        except Exception as e:
+            # The cache must never fail a chat turn
+            self.errors += 1
+            logger.warning(f"Semantic cache lookup failed: {e}")
+            return None, None
+        finally:
+            self._lookup_seconds += time.perf_counter() - started
+
+    async def store(self, question: str, answer: str, embedding: Optional[np.ndarray] = None):
+        """Cache an answer for a question"""
+        key = normalize_question(question)
+        try:
+            if embedding is None:
+                embedding = await self._embed(key)
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, embedding.shape[0]), dtype=np.float32)
+
+            now = time.monotonic()
+            slot = self._by_key.get(key)
+            if slot is None:
+                slot = self._free_slot(now)
+            self._set_slot(slot, key, answer, embedding, now)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Semantic cache store failed: {e}")
+
+    def _free_slot(self, now: float) -> int:
+        """Pick an empty or expired slot, evicting the least recently used one if needed"""
+        free = np.flatnonzero(~self._live_mask(now))
+        if free.size:
+            return int(free[0])
+        slot = int(np.argmin(self._last_used))
+        self.evictions += 1
+        return slot
+
+    def _set_slot(self, slot: int, key: str, answer: str, embedding: np.ndarray, now: float):
+        old_key = self._keys[slot]
+        if old_key is not None and self._by_key.get(old_key) == slot:
+            del self._by_key[old_key]
+        self._vectors[slot] = embedding
+        self._answers[slot] = answer
+        self._keys[slot] = key
+        self._expires_at[slot] = now + self.ttl_seconds
+        self._last_used[slot] = now
+        self._occupied[slot] = True
+        self._by_key[key] = slot
+
+    def clear(self):
+        self._answers = [None] * self.max_entries
+        self._keys = [None] * self.max_entries
+        self._by_key.clear()
+        self._occupied[:] = False
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        now = time.monotonic()
+        return {
+            "enabled": settings.semantic_cache_enabled,
+            "entries": int(self._live_mask(now).sum()),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "exact_hits": self.exact_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "errors": self.errors,
+            "evictions": self.evictions,
+            "avg_lookup_ms": round(self._lookup_seconds / lookups * 1000, 2) if lookups else 0.0,
+            "avg_embed_ms": round(self._embed_seconds / self._embed_calls * 1000, 2) if self._embed_calls else 0.0,
+        }
+
+
+semantic_cache = SemanticCache(
+    threshold=settings.semantic_cache_threshold,
+    ttl_seconds=settings.semantic_cache_ttl_seconds,
+    max_entries=settings.semantic_cache_max_entries,
+)
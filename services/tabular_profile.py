@@ -0,0 +1,138 @@
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+import pandas as pd
+
+
+def _format_value(value: Any, max_chars: int = 40) -> str:
+    if isinstance(value, float):
+        text = f"{value:.6g}"
+    elif isinstance(value, pd.Timestamp):
+        text = value.isoformat(sep=" ")
+    else:
+        text = str(value)
+    return text if len(text) <= max_chars else text[:max_chars - 3] + "..."
+
+
+@dataclass
+class ColumnProfile:
+    name: str
+    count: int = 0  # non-null values
+    nulls: int = 0
+    kinds: Counter = field(default_factory=Counter)  # numeric / datetime / bool / text
+    min: Any = None
+    max: Any = None
+    top: Counter = field(default_factory=Counter)
+    top_truncated: bool = False  # counts of rarer values were dropped, so top values are approximate
+
+    @property
+    def dtype(self) -> str:
+        kinds = [kind for kind, n in self.kinds.items() if n]
+        if not kinds:
+            return "empty"
+        return kinds[0] if len(kinds) == 1 else "mixed"
+
+    def _update_range(self, low, high):
+        try:
+            self.min = low if self.min is None else min(self.min, low)
+            self.max = high if self.max is None else max(self.max, high)
+        except TypeError:  # e.g. numbers in one chunk, dates in another
+            pass
+
+
+class ColumnProfiler:
+    """Per-column statistics of a table, computed one DataFrame chunk at a time.
+
+    Each chunk is reduced with vectorized pandas operations (null counts,
+    min/max, value_counts) and then dropped, so memory stays bounded by the
+    chunk size however long the table is. Top values are tracked in a
+    counter capped at ``max_tracked_values`` per column; past that only the
+    most frequent values are kept and the result is marked approximate.
+    """
+
+    def __init__(self, top_n: int = 3, max_tracked_values: int = 10000):
+        self.top_n = top_n
+        self.max_tracked_values = max_tracked_values
+        self.rows = 0
+        self.columns: Dict[str, ColumnProfile] = {}
+
+    def update(self, chunk: pd.DataFrame):
+        self.rows += len(chunk)
+        for name in chunk.columns:
+            key = str(name)
+            profile = self.columns.get(key)
+            if profile is None:
+                profile = self.columns[key] = ColumnProfile(key)
+            self._update_column(profile, chunk[name])
+
+    def _update_column(self, profile: ColumnProfile, series: pd.Series):
+        values = series.dropna()
+        profile.nulls += len(series) - len(values)
+        profile.count += len(values)
+        if values.empty:
+            return
+
+        if pd.api.types.is_bool_dtype(values):
+            profile.kinds["bool"] += len(values)
+        elif pd.api.types.is_numeric_dtype(values):
+            profile.kinds["numeric"] += len(values)
+            profile._update_range(values.min(), values.max())
+        elif pd.api.types.is_datetime64_any_dtype(values):
+            profile.kinds["datetime"] += len(values)
+            profile._update_range(values.min(), values.max())
+        else:
+            # Object columns (spreadsheet cells, mixed CSV fields): split numbers from text
+            numbers = pd.to_numeric(values, errors="coerce")
+            numeric = numbers.notna()
+            n_numeric = int(numeric.sum())
+            if n_numeric:
+                profile.kinds["numeric"] += n_numeric
+                profile._update_range(numbers[numeric].min(), numbers[numeric].max())
+            profile.kinds["text"] += len(values) - n_numeric
+
+        counts = values.astype(str).value_counts()
+        if len(counts) > self.max_tracked_values:
+            counts = counts.iloc[:self.max_tracked_values]
+            profile.top_truncated = True
+        profile.top.update(counts.to_dict())
+        if len(profile.top) > self.max_tracked_values:
+            profile.top = Counter(dict(profile.top.most_common(self.max_tracked_values // 2)))
+            profile.top_truncated = True
+
+    def describe(self, max_columns: int = 30) -> str:
+        """Human/LLM readable summary, one line per column"""
+        lines = []
+        for profile in list(self.columns.values())[:max_columns]:
+            total = profile.count + profile.nulls
+            null_pct = profile.nulls / total * 100 if total else 0.0
+            parts = [f"{null_pct:.1f}% null"]
+            if profile.min is not None:
+                parts.append(f"min {_format_value(profile.min)}, max {_format_value(profile.max)}")
+            top = profile.top.most_common(self.top_n)
+            # Values that never repeat, or approximate counts of continuous
+            # values, say nothing about the column
+            noisy = profile.top_truncated and profile.dtype in ("numeric", "datetime")
+            if top and top[0][1] > 1 and not noisy:
+                approx = "~" if profile.top_truncated else ""
+                parts.append("top: " + ", ".join(f"{_format_value(v)} ({approx}{n})" for v, n in top))
+            elif top:
+                parts.append("all values distinct" if not profile.top_truncated else "mostly distinct values")
+            lines.append(f"- {profile.name} ({profile.dtype}): " + "; ".join(parts))
+        if len(self.columns) > max_columns:
+            lines.append(f"- ... {len(self.columns) - max_columns} more columns")
+        return "\n".join(lines)
+
+
+def unique_headers(values: List[Optional[Any]]) -> List[str]:
+    """Header row to column names: blanks get placeholders and duplicates a suffix"""
+    names = []
+    seen: Dict[str, int] = {}
+    for i, value in enumerate(values):
+        name = str(value).strip() if value is not None and str(value).strip() else f"column_{i + 1}"
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}_{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
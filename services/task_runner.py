@@ -0,0 +1,56 @@
+import asyncio
+from typing import Awaitable, Optional, Set
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundTaskRunner:
+    """Runs fire-and-forget coroutines off the request path.
+
+    Keeps a reference to every pending task so it is not garbage collected
+    mid-flight, logs failures instead of losing them, and lets the app drain
+    outstanding work on shutdown.
+    """
+
+    def __init__(self):
+        self._tasks: Set[asyncio.Task] = set()
+        self.submitted = 0
+        self.failed = 0
+
+    def submit(self, coro: Awaitable, name: Optional[str] = None) -> asyncio.Task:
+        """Schedule a coroutine and return immediately"""
+        task = asyncio.create_task(coro, name=name)
+        self._tasks.add(task)
+        self.submitted += 1
+        task.add_done_callback(self._on_done)
+        return task
+
+    def _on_done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if task.cancelled():
+            return
+        exc = task.exception()
+        if exc is not None:
+            self.failed += 1
+            logger.error(f"Background task {task.get_name()} failed: {exc!r}")
+
+    @property
+    def pending(self) -> int:
+        return len(self._tasks)
+
+    async def shutdown(self, timeout: float = 10.0):
+        """Wait for pending tasks, cancelling whatever is still running after timeout"""
+        if not self._tasks:
+            return
+        done, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.warning(f"Cancelled {len(pending)} background tasks on shutdown")
+
+    def stats(self) -> dict:
+        return {"pending": self.pending, "submitted": self.submitted, "failed": self.failed}
+
+
+task_runner = BackgroundTaskRunner()
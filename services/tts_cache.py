@@ -0,0 +1,153 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+import uuid
+from typing import AsyncGenerator, AsyncIterator, Optional
+import aiofiles
+import aiofiles.os
+from config import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+_KEY_RE = re.compile(r"[0-9a-f]{64}")
+
+
+class TTSCache:
+    """Synthesized speech kept on disk, keyed by what was synthesized.
+
+    The key is a SHA-256 of the text, voice, model and deployment, and doubles
+    as the audio's ETag. Files are written while the first synthesis streams
+    to the client and only become visible once the stream completes, so a
+    cancelled read-aloud never leaves partial audio behind.
+
+    The directory may be shared by several workers, so the disk is the only
+    index: lookups check for the file, and after each store the directory is
+    scanned to keep the total under ``max_bytes``, removing the least recently
+    played files first. Recency is kept in file access times.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int, part_grace_seconds: float = 3600):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.part_grace_seconds = part_grace_seconds
+        self._scanned = False
+
+        # Directory totals as of the last scan
+        self._files = 0
+        self._total_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.discarded = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(text: str, voice: str, model: str) -> str:
+        payload = json.dumps([text, voice, model, settings.azure_tts_openai_api_deployment_name])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.mp3")
+
+    def lookup(self, key: str) -> Optional[str]:
+        """Path of the cached audio for a key, or None"""
+        if not _KEY_RE.fullmatch(key):
+            self.misses += 1
+            return None
+        path = self._path(key)
+        try:
+            # Record the access without touching mtime, which backs Last-Modified
+            os.utime(path, (time.time(), os.stat(path).st_mtime))
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path
+
+    async def tee(self, key: str, chunks: AsyncGenerator[bytes, None]) -> AsyncIterator[bytes]:
+        """Pass chunks through while writing them to the cache.
+
+        The file is added only if the stream runs to the end; a stream that
+        is cancelled or fails is discarded.
+        """
+        if not self._scanned:
+            await asyncio.to_thread(self._scan)
+        temp_path = os.path.join(self.cache_dir, f"{key}.{uuid.uuid4().hex}.part")
+        size = 0
+        complete = False
+        try:
+            async with aiofiles.open(temp_path, "wb") as f:
+                async for chunk in chunks:
+                    await f.write(chunk)
+                    size += len(chunk)
+                    yield chunk
+            complete = True
+        finally:
+            # Closing the source stops synthesis if the client went away
+            await chunks.aclose()
+            if complete and 0 < size <= self.max_bytes:
+                await aiofiles.os.replace(temp_path, self._path(key))
+                self.stored += 1
+                await asyncio.to_thread(self._scan)
+            else:
+                self.discarded += 1
+                try:
+                    await aiofiles.os.remove(temp_path)
+                except FileNotFoundError:
+                    pass
+
+    def _scan(self):
+        """Total the cached files on disk and evict down to max_bytes, oldest access first"""
+        self._scanned = True
+        now = time.time()
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            try:
+                stat = entry.stat()
+                if entry.name.endswith(".part"):
+                    # Another worker may still be writing it; only clear abandoned ones
+                    if now - stat.st_mtime > self.part_grace_seconds:
+                        os.remove(entry.path)
+                    continue
+            except FileNotFoundError:
+                continue
+            key, ext = os.path.splitext(entry.name)
+            if ext == ".mp3" and _KEY_RE.fullmatch(key):
+                files.append((stat.st_atime, entry.path, stat.st_size))
+
+        total = sum(size for _, _, size in files)
+        files.sort()
+        evicted = 0
+        while total > self.max_bytes and evicted < len(files):
+            _, path, size = files[evicted]
+            evicted += 1
+            total -= size
+            try:
+                os.remove(path)
+                self.evictions += 1
+            except FileNotFoundError:
+                pass  # evicted by another worker
+        self._files = len(files) - evicted
+        self._total_bytes = total
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "files": self._files,
+            "bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "stored": self.stored,
+            "discarded": self.discarded,
+            "evictions": self.evictions,
+        }
+
+
+tts_cache = TTSCache(settings.tts_cache_dir, settings.tts_cache_max_bytes, settings.tts_cache_part_grace_seconds)
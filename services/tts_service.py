@@ -0,0 +1,237 @@
+import asyncio
+import re
+import time
+from typing import AsyncIterator, List, Optional
+import httpx
+from config import settings
+from services.http_clients import http_clients
+import logging
+
+logger = logging.getLogger(__name__)
+
+# End of a sentence: Latin punctuation followed by whitespace (so "3.14" and
+# "v1.2" stay whole), Devanagari danda/double danda and CJK full stops with or
+# without it, or a line break (list items, headings)
+_SENTENCE_END = re.compile(
+    r"(?:[.!?\u2026]+[\"'\u201d\u2019\u00bb)\]]*(?=\s|$)|[\u0964\u0965\u3002\uff01\uff1f]+[\"'\u201d\u2019\u00bb)\]]*|\n+)"
+)
+
+
+def _split_long(sentence: str, max_chars: int) -> List[str]:
+    """Break a sentence longer than max_chars at a clause or word boundary"""
+    pieces = []
+    while len(sentence) > max_chars:
+        cut = max(sentence.rfind(", ", 0, max_chars), sentence.rfind("; ", 0, max_chars))
+        if cut <= 0:
+            cut = sentence.rfind(" ", 0, max_chars)
+        if cut <= 0:
+            cut = max_chars - 1
+        pieces.append(sentence[:cut + 1].strip())
+        sentence = sentence[cut + 1:].strip()
+    if sentence:
+        pieces.append(sentence)
+    return pieces
+
+
+def split_for_speech(text: str, max_chars: int = 1000, first_chars: int = 200) -> List[str]:
+    """Split text at sentence boundaries into segments to synthesize separately.
+
+    Sentences are packed into segments of up to max_chars; the first segment
+    is limited to first_chars so its audio is ready quickly.
+    """
+    sentences, start = [], 0
+    for match in _SENTENCE_END.finditer(text):
+        sentences.append(text[start:match.end()])
+        start = match.end()
+    sentences.append(text[start:])
+
+    segments, current = [], ""
+    for sentence in sentences:
+        limit = max_chars if segments else first_chars
+        for piece in _split_long(" ".join(sentence.split()), limit):
+            limit = max_chars if segments else first_chars
+            if current and len(current) + 1 + len(piece) > limit:
+                segments.append(current)
+                current = piece
+            else:
+                current = f"{current} {piece}" if current else piece
+    if current:
+        segments.append(current)
+    return segments
+
+
+class TTSService:
+    """Azure OpenAI text-to-speech, relayed to the client as it is synthesized.
+
+    ``open_stream`` waits only for the upstream status and headers, so errors
+    can still become a proper HTTP error response; ``iter_audio`` then passes
+    audio chunks through as they arrive and closes the upstream request when
+    the stream ends or the client disconnects.
+
+    Texts longer than ``long_text_chars`` are split into sentence segments
+    that are synthesized concurrently (at most ``segment_concurrency`` at
+    once) and streamed back in order, so the first audio does not wait for
+    the whole text.
+    """
+
+    def __init__(self, long_text_chars: int = 600, first_segment_chars: int = 200,
+                 segment_max_chars: int = 1000, segment_concurrency: int = 4):
+        self.long_text_chars = long_text_chars
+        self.first_segment_chars = first_segment_chars
+        self.segment_max_chars = segment_max_chars
+        self.segment_concurrency = segment_concurrency
+
+        self.streams_started = 0
+        self.streams_completed = 0
+        self.streams_cancelled = 0
+        self.streams_failed = 0
+        self.bytes_streamed = 0
+        self._open_seconds = 0.0
+        self._opened = 0
+        self._first_byte_seconds = 0.0
+        self._first_bytes = 0
+        self.segmented_requests = 0
+        self.segments = 0
+        self._segmented_first_seconds = 0.0
+
+    @property
+    def speech_url(self) -> str:
+        return (
+            f"/openai/deployments/{settings.azure_tts_openai_api_deployment_name}"
+            f"/audio/speech?api-version={settings.azure_tts_openai_api_version}"
+        )
+
+    async def open_stream(self, text: str, voice: str, model: str) -> httpx.Response:
+        """Start synthesis and return the upstream response once its headers arrive.
+
+        Raises httpx.HTTPError if the request fails or TTS returns an error status.
+        """
+        client = http_clients.get("tts")
+        request = client.build_request(
+            "POST",
+            self.speech_url,
+            headers={"api-key": settings.azure_tts_openai_api_key},
+            json={"model": model, "input": text, "voice": voice},
+        )
+        started = time.perf_counter()
+        response = await client.send(request, stream=True)
+        self._open_seconds += time.perf_counter() - started
+        self._opened += 1
+        if response.is_error:
+            await response.aread()
+            await response.aclose()
+            self.streams_failed += 1
+            response.raise_for_status()
+        return response
+
+    async def open_audio(self, text: str, voice: str, model: str) -> AsyncIterator[bytes]:
+        """Start synthesis and return the audio stream once it has begun.
+
+        Raises httpx.HTTPError if synthesis cannot start.
+        """
+        if len(text) > self.long_text_chars:
+            segments = split_for_speech(text, self.segment_max_chars, self.first_segment_chars)
+            if len(segments) > 1:
+                return await self._open_segmented(segments, voice, model)
+        return self.iter_audio(await self.open_stream(text, voice, model))
+
+    async def _open_segmented(self, segments: List[str], voice: str, model: str) -> AsyncIterator[bytes]:
+        started = time.perf_counter()
+        slots = asyncio.Semaphore(self.segment_concurrency)
+        # Each segment's chunks, then None when it is done or the exception it failed with
+        queues = [asyncio.Queue() for _ in segments]
+
+        async def synthesize(segment: str, queue: asyncio.Queue):
+            try:
+                async with slots:
+                    response = await self.open_stream(segment, voice, model)
+                    async for chunk in self.iter_audio(response):
+                        queue.put_nowait(chunk)
+                queue.put_nowait(None)
+            except Exception as e:
+                queue.put_nowait(e)
+
+        tasks = [asyncio.create_task(synthesize(segment, queue)) for segment, queue in zip(segments, queues)]
+        self.segmented_requests += 1
+        self.segments += len(segments)
+
+        # Wait for the first audio here, so a failure can still become an error response
+        first = await queues[0].get()
+        if isinstance(first, Exception):
+            for task in tasks:
+                task.cancel()
+            raise first
+        self._segmented_first_seconds += time.perf_counter() - started
+        return self._iter_segments(queues, tasks, first)
+
+    async def _iter_segments(self, queues: List[asyncio.Queue], tasks: List[asyncio.Task],
+                             first: Optional[bytes]) -> AsyncIterator[bytes]:
+        try:
+            if first is not None:
+                yield first
+            for i, queue in enumerate(queues):
+                if i == 0 and first is None:
+                    continue  # the first segment had no audio at all
+                while True:
+                    item = await queue.get()
+                    if item is None:
+                        break
+                    if isinstance(item, Exception):
+                        logger.error(f"TTS segment {i + 1}/{len(queues)} failed: {item!r}")
+                        raise item
+                    yield item
+        finally:
+            # Stop synthesizing the rest if the client went away or a segment failed
+            for task in tasks:
+                task.cancel()
+
+    async def iter_audio(self, response: httpx.Response) -> AsyncIterator[bytes]:
+        """Relay the upstream audio chunk by chunk, closing it however the stream ends"""
+        self.streams_started += 1
+        started = time.perf_counter()
+        first = True
+        try:
+            # No chunk_size: re-chunking would hold audio back until a buffer fills
+            async for chunk in response.aiter_bytes():
+                if first:
+                    self._first_byte_seconds += time.perf_counter() - started
+                    self._first_bytes += 1
+                    first = False
+                self.bytes_streamed += len(chunk)
+                yield chunk
+            self.streams_completed += 1
+        except (asyncio.CancelledError, GeneratorExit):
+            # The client went away; stop synthesis instead of downloading the rest
+            self.streams_cancelled += 1
+            raise
+        except httpx.HTTPError as e:
+            self.streams_failed += 1
+            logger.error(f"TTS stream broke off: {e!r}")
+            raise
+        finally:
+            await response.aclose()
+
+    def stats(self) -> dict:
+        return {
+            "streams_started": self.streams_started,
+            "streams_completed": self.streams_completed,
+            "streams_cancelled": self.streams_cancelled,
+            "streams_failed": self.streams_failed,
+            "bytes_streamed": self.bytes_streamed,
+            "avg_headers_ms": round(self._open_seconds / self._opened * 1000, 1) if self._opened else 0.0,
+            "avg_first_chunk_ms": round(self._first_byte_seconds / self._first_bytes * 1000, 1) if self._first_bytes else 0.0,
+            "segmented_requests": self.segmented_requests,
+            "segments": self.segments,
+            "avg_segmented_first_chunk_ms": (
+                round(self._segmented_first_seconds / self.segmented_requests * 1000, 1)
+                if self.segmented_requests else 0.0
+            ),
+        }
+
+
+tts_service = TTSService(
+    long_text_chars=settings.tts_long_text_chars,
+    first_segment_chars=settings.tts_first_segment_chars,
+    segment_max_chars=settings.tts_segment_max_chars,
+    segment_concurrency=settings.tts_segment_concurrency,
+)
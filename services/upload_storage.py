@@ -0,0 +1,91 @@
+import hashlib
+import os
+import uuid
+from dataclasses import dataclass
+import aiofiles
+import aiofiles.os
+from fastapi import UploadFile
+from config import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class UploadTooLarge(Exception):
+    """The upload exceeded the configured maximum size"""
+
+
+@dataclass
+class StoredUpload:
+    path: str  # location on disk
+    stored_name: str  # file name inside the upload dir, used in /uploads/ URLs
+    original_filename: str
+    content_type: str
+    size: int
+    sha256: str
+    deduplicated: bool = False  # identical content was already stored
+
+
+class UploadStorage:
+    """Streams uploads to disk without blocking the event loop.
+
+    The body is read in chunks, counted and hashed as it goes, and abandoned
+    as soon as it passes ``max_size``. Files are stored under their SHA-256
+    content hash, so the same document uploaded again (in any chat) is never
+    written twice; new content is then copied to disk with aiofiles.
+    """
+
+    def __init__(self, upload_dir: str, max_size: int, chunk_size: int = 1024 * 1024):
+        self.upload_dir = upload_dir
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+
+    async def save(self, file: UploadFile) -> StoredUpload:
+        """Store an upload in the upload dir; raises UploadTooLarge past max_size"""
+        # First pass: size check and content hash, nothing written yet
+        hasher = hashlib.sha256()
+        size = 0
+        while chunk := await file.read(self.chunk_size):
+            size += len(chunk)
+            if size > self.max_size:
+                raise UploadTooLarge(f"File exceeds the {self.max_size} byte limit")
+            hasher.update(chunk)
+
+        sha256 = hasher.hexdigest()
+        file_extension = os.path.splitext(file.filename or "")[1].lower()
+        stored_name = f"{sha256}{file_extension}"
+        path = os.path.join(self.upload_dir, stored_name)
+
+        deduplicated = await aiofiles.os.path.exists(path)
+        if not deduplicated:
+            await file.seek(0)
+            await self._write(file, path)
+
+        return StoredUpload(
+            path=path,
+            stored_name=stored_name,
+            original_filename=file.filename or stored_name,
+            content_type=file.content_type or "application/octet-stream",
+            size=size,
+            sha256=sha256,
+            deduplicated=deduplicated,
+        )
+
+
+    async def _write(self, file: UploadFile, path: str):
+        """Copy the upload to path via a temp file, so readers never see a partial file"""
+        temp_path = os.path.join(self.upload_dir, f".upload-{uuid.uuid4().hex}.part")
+        try:
+            async with aiofiles.open(temp_path, "wb") as out:
+                while chunk := await file.read(self.chunk_size):
+                    await out.write(chunk)
+            await aiofiles.os.replace(temp_path, path)
+        except BaseException:
+            try:
+                await aiofiles.os.remove(temp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+
+upload_storage = UploadStorage(settings.upload_dir, settings.max_file_size, settings.upload_chunk_size)
@@ -0,0 +1,135 @@
+import asyncio
+from typing import Awaitable, Callable, List, Optional, Tuple
+from models import FileInfo, Message
+from services.chat_service import chat_service
+from services.context_builder import context_builder
+from services.document_index import document_index, INDEXED_FILE_TYPES
+from services.file_processor import file_processor
+from services.task_runner import task_runner
+from services.upload_storage import StoredUpload
+from config import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+StageCallback = Callable[[str, int], Awaitable[None]]
+
+
+def _file_info(stored: StoredUpload) -> FileInfo:
+    return FileInfo(
+        filename=stored.original_filename,
+        type=stored.content_type,
+        url=f"/uploads/{stored.stored_name}",
+        size=stored.size,
+    )
+
+
+async def _extract_and_index(chat_id: str, stored: StoredUpload, index_inline: bool = False,
+                             on_indexing: Optional[Callable[[], Awaitable[None]]] = None) -> Tuple[str, str]:
+    """Extract an upload and index its full text; returns (processed_content, file_type)"""
+    processed_content, file_type = await file_processor.process_upload(
+        stored.path, stored.original_filename, stored.sha256
+    )
+
+    # Index the full text so later questions can retrieve from all of it;
+    # the preview above only covers the start of the document
+    if settings.document_index_enabled and file_type in INDEXED_FILE_TYPES:
+        await chat_service.attach_document(chat_id, stored.sha256)
+        indexing = document_index.index_document(stored.sha256, stored.original_filename, stored.path)
+        if index_inline:
+            if on_indexing is not None:
+                await on_indexing()
+            await indexing
+        else:
+            task_runner.submit(indexing, name=f"index-{stored.sha256[:12]}")
+    return processed_content, file_type
+
+
+def fit_to_budget(contents: List[str], max_tokens: int) -> List[str]:
+    """Trim several texts to share max_tokens fairly.
+
+    Short texts are kept whole and the budget they leave is split among the
+    longer ones, so one large document cannot crowd out the rest.
+    """
+    sizes = [context_builder.count_tokens(text) for text in contents]
+    allowed = [0] * len(contents)
+    remaining = max_tokens
+    order = sorted(range(len(contents)), key=lambda i: sizes[i])
+    for position, i in enumerate(order):
+        share = remaining // (len(contents) - position)
+        allowed[i] = min(sizes[i], share)
+        remaining -= allowed[i]
+    return [
+        text if allowed[i] >= sizes[i] else context_builder.truncate(text, allowed[i]) + "\n[...truncated]"
+        for i, text in enumerate(contents)
+    ]
+
+
+async def process_upload_turn(chat_id: str, stored: StoredUpload,
+                              message: Optional[str] = None,
+                              original_content: Optional[str] = None,
+                              web_search_results: Optional[str] = None,
+                              index_inline: bool = False,
+                              on_stage: Optional[StageCallback] = None) -> Tuple[Message, Message]:
+    """Extract a stored upload, index it and answer it as a chat turn.
+
+    Shared by the synchronous upload endpoint and ingestion jobs. With
+    ``index_inline`` the full-text indexing is awaited (jobs report it as a
+    stage); otherwise it runs on the background task runner.
+    """
+    async def stage(name: str, progress: int):
+        if on_stage is not None:
+            await on_stage(name, progress)
+
+    await stage("extracting", 20)
+    processed_content, file_type = await _extract_and_index(
+        chat_id, stored, index_inline, on_indexing=lambda: stage("indexing", 50)
+    )
+
+    file_info = _file_info(stored)
+    combined_message = f"{message or ''}\n\n{processed_content}".strip()
+
+    # Only send image path if vision is needed
+    image_path = stored.path if file_type == "image" else None
+
+    await stage("responding", 75)
+    return await chat_service.process_message(
+        chat_id=chat_id,
+        content=combined_message,
+        original_content=original_content,
+        file_info=file_info,
+        web_search_results=web_search_results,
+        image_path=image_path
+    )
+
+
+async def process_batch_upload_turn(chat_id: str, stored_files: List[StoredUpload],
+                                    message: Optional[str] = None,
+                                    original_content: Optional[str] = None,
+                                    web_search_results: Optional[str] = None) -> Tuple[Message, Message]:
+    """Answer several uploads in a single chat turn.
+
+    Files are extracted concurrently (at most ``batch_upload_concurrency`` at
+    once) and their content is combined within ``batch_upload_max_tokens``, so
+    the model is called once for the whole batch.
+    """
+    slots = asyncio.Semaphore(settings.batch_upload_concurrency)
+
+    async def extract(stored: StoredUpload) -> Tuple[str, str]:
+        async with slots:
+            return await _extract_and_index(chat_id, stored)
+
+    results = await asyncio.gather(*(extract(stored) for stored in stored_files))
+
+    contents = fit_to_budget([content for content, _ in results], settings.batch_upload_max_tokens)
+    combined_message = "\n\n".join([message or "", *contents]).strip()
+    image_paths = [stored.path for stored, (_, file_type) in zip(stored_files, results) if file_type == "image"]
+
+    return await chat_service.process_message(
+        chat_id=chat_id,
+        content=combined_message,
+        original_content=original_content,
+        web_search_results=web_search_results,
+        image_path=image_paths or None,
+        files=[_file_info(stored) for stored in stored_files],
+    )
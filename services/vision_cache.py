@@ -0,0 +1,151 @@
+import base64
+import io
+import os
+import uuid
+from typing import Tuple
+import aiofiles
+import aiofiles.os
+from PIL import Image, ImageOps
+from config import settings
+from services.extraction_pool import extraction_pool
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Formats the vision endpoint accepts as-is
+PASSTHROUGH_FORMATS = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp", "GIF": "image/gif"}
+
+
+def vision_size(width: int, height: int, max_long_side: int, max_short_side: int) -> Tuple[int, int]:
+    """Largest size within the vision model's effective resolution, keeping the aspect ratio.
+
+    High-detail vision inputs are scaled to fit max_long_side square and then
+    to max_short_side on the short side upstream; pixels beyond that are only
+    paid for in upload size and latency.
+    """
+    scale = min(1.0, max_long_side / max(width, height), max_short_side / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def encode_for_vision(file_path: str, max_long_side: int, max_short_side: int,
+                      quality: int) -> Tuple[str, bytes]:
+    """Downscale and re-encode an image for the vision model; returns (mime type, bytes).
+
+    Images already small enough are sent unchanged, avoiding a lossy re-encode.
+    """
+    with Image.open(file_path) as img:
+        target = vision_size(img.width, img.height, max_long_side, max_short_side)
+        if target == img.size and img.format in PASSTHROUGH_FORMATS:
+            with open(file_path, "rb") as f:
+                return PASSTHROUGH_FORMATS[img.format], f.read()
+
+        img = ImageOps.exif_transpose(img)  # the re-encode drops EXIF, so apply orientation now
+        target = vision_size(img.width, img.height, max_long_side, max_short_side)
+        if img.size != target:
+            img = img.resize(target, Image.LANCZOS)
+
+        out = io.BytesIO()
+        if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+            img.save(out, format="PNG", optimize=True)
+            return "image/png", out.getvalue()
+        img.convert("RGB").save(out, format="JPEG", quality=quality, optimize=True)
+        return "image/jpeg", out.getvalue()
+
+
+def _encode_for_vision_job(file_path: str, max_long_side: int, max_short_side: int,
+                           quality: int) -> Tuple[str, bytes]:
+    """Entry point for extraction pool workers"""
+    return encode_for_vision(file_path, max_long_side, max_short_side, quality)
+
+
+class VisionCache:
+    """Data URLs of uploaded images, prepared once for the vision model.
+
+    Uploads are stored under their content hash, so the stored file name is
+    the cache key: the first turn that sends an image downsizes and encodes it
+    in the extraction pool and writes the data URL to ``cache_dir``; any later
+    request with the same image reads it back instead of re-encoding.
+    """
+
+    def __init__(self, cache_dir: str, max_long_side: int = 2048,
+                 max_short_side: int = 768, quality: int = 85):
+        self.cache_dir = cache_dir
+        self.max_long_side = max_long_side
+        self.max_short_side = max_short_side
+        self.quality = quality
+
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.bytes_original = 0
+        self.bytes_encoded = 0
+
+    def _cache_path(self, image_path: str) -> str:
+        return os.path.join(self.cache_dir, f"{os.path.basename(image_path)}.url")
+
+    async def get_data_url(self, image_path: str) -> str:
+        """Data URL of the image as it should be sent to the vision model"""
+        cache_path = self._cache_path(image_path)
+        try:
+            async with aiofiles.open(cache_path, "r") as f:
+                data_url = await f.read()
+            self.hits += 1
+            return data_url
+        except FileNotFoundError:
+            self.misses += 1
+
+        try:
+            mime_type, data = await extraction_pool.run(
+                _encode_for_vision_job, image_path,
+                self.max_long_side, self.max_short_side, self.quality,
+            )
+        except Exception as e:
+            # Fall back to the original bytes rather than failing the turn
+            self.errors += 1
+            logger.warning(f"Could not prepare {image_path} for vision, sending it unchanged: {e}")
+            async with aiofiles.open(image_path, "rb") as f:
+                data = await f.read()
+            return f"data:{self._guess_mime(image_path)};base64,{base64.b64encode(data).decode('ascii')}"
+
+        data_url = f"data:{mime_type};base64,{base64.b64encode(data).decode('ascii')}"
+        self.bytes_original += (await aiofiles.os.stat(image_path)).st_size
+        self.bytes_encoded += len(data)
+        await self._store(cache_path, data_url)
+        return data_url
+
+    async def _store(self, cache_path: str, data_url: str):
+        temp_path = f"{cache_path}.{uuid.uuid4().hex}.part"
+        try:
+            async with aiofiles.open(temp_path, "w") as f:
+                await f.write(data_url)
+            await aiofiles.os.replace(temp_path, cache_path)
+        except OSError as e:
+            logger.warning(f"Could not cache vision payload {cache_path}: {e}")
+            try:
+                await aiofiles.os.remove(temp_path)
+            except FileNotFoundError:
+                pass
+
+    @staticmethod
+    def _guess_mime(image_path: str) -> str:
+        ext = os.path.splitext(image_path)[1].lower().lstrip(".")
+        return {"png": "image/png", "gif": "image/gif", "webp": "image/webp"}.get(ext, "image/jpeg")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "errors": self.errors,
+            "bytes_original": self.bytes_original,
+            "bytes_encoded": self.bytes_encoded,
+        }
+
+
+vision_cache = VisionCache(
+    settings.vision_cache_dir,
+    max_long_side=settings.vision_max_long_side,
+    max_short_side=settings.vision_max_short_side,
+    quality=settings.vision_jpeg_quality,
+)
@@ -0,0 +1,311 @@
+import asyncio
+import math
+import re
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+from bs4 import BeautifulSoup
+import httpx
+from config import settings
+from models import Reference
+from services.context_builder import context_builder
+from services.http_clients import http_clients
+from services.public_network import BlockedURL
+from services.search_service import search_service
+import logging
+
+logger = logging.getLogger(__name__)
+
+HTML_TYPES = {"text/html", "application/xhtml+xml", "text/plain"}
+
+# Page furniture that is never part of the main text
+BOILERPLATE_TAGS = ["script", "style", "noscript", "template", "svg", "iframe", "nav",
+                    "header", "footer", "aside", "form", "button"]
+BLOCK_TAGS = ["p", "li", "h1", "h2", "h3", "h4", "h5", "h6", "pre", "blockquote", "td", "dd"]
+MIN_BLOCK_CHARS = 30
+MAX_PASSAGES_PER_PAGE = 60
+MAX_REDIRECTS = 3
+
+# \w leaves out Indic vowel signs and viramas, which would split words apart
+_TERM_RE = re.compile(r"[\w\u0900-\u0dff]+")
+
+
+def extract_passages(html: bytes, encoding: Optional[str] = None, passage_chars: int = 700) -> List[str]:
+    """Main text of an HTML page, grouped into passages of about passage_chars.
+
+    Boilerplate (navigation, headers, footers, scripts) is dropped and
+    ``<article>`` or ``<main>`` is preferred when the page has one.
+    """
+    soup = BeautifulSoup(html, "lxml", from_encoding=encoding)
+    for tag in soup(BOILERPLATE_TAGS):
+        tag.decompose()
+    root = soup.find("article") or soup.find("main") or soup.body or soup
+
+    blocks = []
+    for element in root.find_all(BLOCK_TAGS):
+        if element.find(BLOCK_TAGS):
+            continue  # its inner blocks are visited on their own
+        text = " ".join(element.get_text(" ").split())
+        if len(text) >= MIN_BLOCK_CHARS and (not blocks or blocks[-1] != text):
+            blocks.append(text)
+    if not blocks:
+        # Pages without block markup: fall back to their text lines
+        blocks = [line for line in (" ".join(l.split()) for l in root.get_text("\n").splitlines())
+                  if len(line) >= MIN_BLOCK_CHARS]
+
+    passages, current = [], ""
+    for block in blocks:
+        if current and len(current) + len(block) + 1 > passage_chars:
+            passages.append(current)
+            if len(passages) >= MAX_PASSAGES_PER_PAGE:
+                return passages
+            current = ""
+        # A single oversized block (a wall of text) still becomes one bounded passage
+        current = f"{current}\n{block}" if current else block[:passage_chars * 2]
+    if current:
+        passages.append(current)
+    return passages
+
+
+def _terms(text: str) -> List[str]:
+    return _TERM_RE.findall(text.casefold())
+
+
+def rank_passages(query: str, passages: List[str], k1: float = 1.2, b: float = 0.75) -> List[float]:
+    """BM25 score of each passage for the query"""
+    query_terms = set(_terms(query))
+    docs = [Counter(_terms(passage)) for passage in passages]
+    if not query_terms or not docs:
+        return [0.0] * len(passages)
+    avg_len = sum(sum(doc.values()) for doc in docs) / len(docs) or 1.0
+    scores = []
+    for doc in docs:
+        length = sum(doc.values())
+        score = 0.0
+        for term in query_terms:
+            tf = doc.get(term, 0)
+            if not tf:
+                continue
+            df = sum(1 for other in docs if term in other)
+            idf = math.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+            score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / avg_len))
+        scores.append(score)
+    return scores
+
+
+@dataclass
+class Grounding:
+    context: str  # the block sent to the model
+    references: List[Reference]  # the sources it was drawn from, in search order
+
+
+def format_web_context(sources: List[Tuple[dict, List[str]]]) -> str:
+    """Render the selected passages of each source as the context block sent to the model"""
+    parts = [
+        f"[{n}] {result['name'] or result['url']} ({result['url']})\n" + "\n\n".join(passages)
+        for n, (result, passages) in enumerate(sources, start=1)
+    ]
+    return ("Passages from web pages found for this question. Cite them by number, "
+            "like [1], where you use them:\n\n" + "\n\n".join(parts))
+
+
+class WebGrounding:
+    """Grounds a chat turn in web pages, found and read server-side.
+
+    The question is searched with the shared search service, the top result
+    pages are fetched concurrently (each within ``fetch_timeout`` and capped
+    at ``max_bytes``), their main text is extracted in a worker thread
+    (within ``parse_timeout``) and split into passages, and the passages
+    ranked best for the question (BM25) are kept within ``max_tokens``. Pages
+    that fail to load fall back to their search snippet. Grounding never fails
+    a turn; it returns None instead.
+
+    Redirects are followed here rather than by httpx, and every hop must
+    resolve to public addresses only; the connection goes to the address that
+    was checked, so a second DNS answer cannot swap in an internal one.
+    """
+
+    def __init__(self, results: int = 5, fetch_timeout: float = 4.0, max_bytes: int = 1048576,
+                 max_tokens: int = 1500, passages_per_page: int = 3, passage_chars: int = 700,
+                 parse_timeout: float = 3.0):
+        self.results = results
+        self.fetch_timeout = fetch_timeout
+        self.parse_timeout = parse_timeout
+        self.max_bytes = max_bytes
+        self.max_tokens = max_tokens
+        self.passages_per_page = passages_per_page
+        self.passage_chars = passage_chars
+
+        self.groundings = 0
+        self.errors = 0
+        self.pages_fetched = 0
+        self.pages_failed = 0
+        self.pages_skipped = 0  # not HTML or text
+        self.pages_blocked = 0  # non-public addresses or too many redirects
+        self.pages_truncated = 0
+        self.bytes_fetched = 0
+        self._fetches = 0
+        self._fetch_seconds = 0.0
+        self._grounding_seconds = 0.0
+
+    async def ground(self, question: str) -> Optional[Grounding]:
+        """Web context and references for a question, or None if nothing usable was found"""
+        query = " ".join(question.split())[:300]
+        if not query:
+            return None
+        started = time.perf_counter()
+        try:
+            results = await search_service.search(query, num=self.results)
+        except Exception:
+            # search_service has logged it; the exception text would carry the API key
+            self.errors += 1
+            self._grounding_seconds += time.perf_counter() - started
+            return None
+        try:
+            results = [result for result in results if result.get("url")]
+            pages = await asyncio.gather(*(self._read_page(result["url"]) for result in results))
+            grounding = self._select(query, results, pages)
+            self.groundings += 1
+            return grounding
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Web grounding failed: {e!r}")
+            return None
+        finally:
+            self._grounding_seconds += time.perf_counter() - started
+
+    async def _read_page(self, url: str) -> List[str]:
+        """Passages of one result page; empty if it could not be read"""
+        started = time.perf_counter()
+        try:
+            html, encoding = await asyncio.wait_for(self._fetch(url), self.fetch_timeout)
+        except (BlockedURL, httpx.TooManyRedirects) as e:
+            self.pages_blocked += 1
+            logger.warning(f"Not fetching {url} for grounding: {e}")
+            return []
+        except Exception as e:
+            self.pages_failed += 1
+            logger.info(f"Could not fetch {url} for grounding: {e!r}")
+            return []
+        finally:
+            self._fetches += 1
+            self._fetch_seconds += time.perf_counter() - started
+        if not html:
+            return []
+        try:
+            # A thread, not the upload extraction pool: turns must not queue behind
+            # uploads, and a slow page must not recycle the pool under them
+            return await asyncio.wait_for(
+                asyncio.to_thread(extract_passages, html, encoding, self.passage_chars),
+                self.parse_timeout,
+            )
+        except Exception as e:
+            self.pages_failed += 1
+            logger.info(f"Could not extract {url} for grounding: {e!r}")
+            return []
+
+    async def _fetch(self, url: str) -> Tuple[bytes, Optional[str]]:
+        """Page body (at most max_bytes) and its declared charset, following redirects"""
+        client = http_clients.get("web")
+        target = httpx.URL(url)
+        for _ in range(MAX_REDIRECTS + 1):
+            request = self._build_request(client, target)
+            response = await client.send(request, stream=True)
+            try:
+                if not response.is_redirect:
+                    return await self._read_body(response)
+                target = target.join(response.headers["location"])
+            finally:
+                await response.aclose()
+        raise httpx.TooManyRedirects(f"More than {MAX_REDIRECTS} redirects", request=request)
+
+    @staticmethod
+    def _build_request(client: httpx.AsyncClient, target: httpx.URL) -> httpx.Request:
+        """A request to target; the "web" client only connects to public addresses"""
+        if target.scheme not in ("http", "https") or not target.host:
+            raise BlockedURL(f"Unsupported URL {target}")
+        return client.build_request("GET", target)
+
+    async def _read_body(self, response: httpx.Response) -> Tuple[bytes, Optional[str]]:
+        """Body of the final response, capped at max_bytes; empty if it is not a page"""
+        response.raise_for_status()
+        content_type = response.headers.get("content-type", "").split(";")[0].strip().lower()
+        if content_type not in HTML_TYPES:
+            self.pages_skipped += 1
+            return b"", None
+        body = bytearray()
+        async for chunk in response.aiter_bytes():
+            body.extend(chunk)
+            if len(body) >= self.max_bytes:
+                # Parse what we have; the main text is usually near the top
+                self.pages_truncated += 1
+                del body[self.max_bytes:]
+                break
+        self.pages_fetched += 1
+        self.bytes_fetched += len(body)
+        return bytes(body), response.charset_encoding
+
+    def _select(self, query: str, results: List[dict], pages: List[List[str]]) -> Optional[Grounding]:
+        """Keep the best-ranked passages within the token budget, grouped by source"""
+        candidates = []  # (source index, passage)
+        for i, (result, passages) in enumerate(zip(results, pages)):
+            if passages:
+                candidates.extend((i, passage) for passage in passages)
+            elif result.get("snippet"):
+                candidates.append((i, result["snippet"]))
+        if not candidates:
+            return None
+
+        scores = rank_passages(query, [passage for _, passage in candidates])
+        # Best score first; ties go to the higher-ranked search result and earlier passage
+        order = sorted(range(len(candidates)), key=lambda c: (-scores[c], candidates[c][0], c))
+
+        chosen = {}  # source index -> [candidate index]
+        used_tokens = 0
+        for c in order:
+            i, passage = candidates[c]
+            if len(chosen.get(i, [])) >= self.passages_per_page:
+                continue
+            tokens = context_builder.count_tokens(passage)
+            if used_tokens + tokens > self.max_tokens:
+                continue
+            used_tokens += tokens
+            chosen.setdefault(i, []).append(c)
+        if not chosen:
+            return None
+
+        sources = [
+            (results[i], [candidates[c][1] for c in sorted(chosen[i])])
+            for i in sorted(chosen)
+        ]
+        references = [
+            Reference(title=result["name"] or result["url"], url=result["url"], snippet=result.get("snippet") or "")
+            for result, _ in sources
+        ]
+        return Grounding(context=format_web_context(sources), references=references)
+
+    def stats(self) -> dict:
+        return {
+            "groundings": self.groundings,
+            "errors": self.errors,
+            "avg_grounding_ms": round(self._grounding_seconds / self.groundings * 1000, 1) if self.groundings else 0.0,
+            "pages_fetched": self.pages_fetched,
+            "pages_failed": self.pages_failed,
+            "pages_skipped": self.pages_skipped,
+            "pages_blocked": self.pages_blocked,
+            "pages_truncated": self.pages_truncated,
+            "bytes_fetched": self.bytes_fetched,
+            "avg_fetch_ms": round(self._fetch_seconds / self._fetches * 1000, 1) if self._fetches else 0.0,
+        }
+
+
+web_grounding = WebGrounding(
+    results=settings.web_grounding_results,
+    fetch_timeout=settings.web_fetch_timeout_seconds,
+    max_bytes=settings.web_fetch_max_bytes,
+    max_tokens=settings.web_context_max_tokens,
+    passages_per_page=settings.web_passages_per_page,
+    passage_chars=settings.web_passage_chars,
+    parse_timeout=settings.web_parse_timeout_seconds,
+)